@@ -0,0 +1,92 @@
+import cPickle as pickle
+import errno
+import hashlib
+import os
+import tempfile
+
+from . import data
+
+# Every row update gives the catalog row a new xmin, and deletions and
+# insertions change the row count, so the sums below change whenever the
+# schema does.  In-place statistics updates (VACUUM, ANALYZE) don't count.
+
+fingerprint_catalogs = [
+	"pg_namespace",
+	"pg_language",
+	"pg_type",
+	"pg_class",
+	"pg_index",
+	"pg_attribute",
+	"pg_attrdef",
+	"pg_constraint",
+	"pg_proc",
+	"pg_trigger",
+	"pg_rewrite",
+	"pg_operator",
+	"pg_opclass",
+	"pg_am",
+]
+
+def get_fingerprint(cursor):
+	catalogs = list(fingerprint_catalogs)
+	if cursor.connection.server_version >= 100000:
+		catalogs.append("pg_sequence")
+
+	columns = ["""(SELECT count(*) || '/' || coalesce(sum(hashtext(oid || rolname)), 0)
+	               FROM pg_catalog.pg_roles)"""]
+	for catalog in catalogs:
+		columns.append("""(SELECT count(*) || '/' || coalesce(sum(xmin::text::bigint), 0)
+		                   FROM pg_catalog.%s)""" % catalog)
+
+	cursor.execute("""SELECT %s""" % ", ".join(columns))
+	return dict(zip(["pg_roles"] + catalogs, cursor.fetchone()))
+
+class Cache(object):
+	def __init__(self, directory):
+		self.directory = directory
+
+	def get_path(self, key):
+		name = hashlib.md5(repr(key)).hexdigest()
+		return os.path.join(self.directory, "%s.pickle" % name)
+
+	# Returns the stored fingerprint and database, or None
+
+	def load(self, key):
+		try:
+			file = open(self.get_path(key), "rb")
+		except IOError:
+			return None
+
+		try:
+			stored_key, stored_fingerprint, db = pickle.load(file)
+		except Exception:
+			return None
+		finally:
+			file.close()
+
+		if stored_key != key:
+			return None
+
+		roots = [db]
+		catalog = getattr(db, "catalog", None)
+		if catalog is not None:
+			roots.extend(catalog.get_objects())
+
+		data.relink(*roots)
+		return stored_fingerprint, db
+
+	def store(self, key, fingerprint, db):
+		try:
+			os.makedirs(self.directory, 0700)
+		except OSError, e:
+			if e.errno != errno.EEXIST:
+				raise
+
+		fd, temp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+		try:
+			with os.fdopen(fd, "wb") as file:
+				pickle.dump((key, fingerprint, db), file, pickle.HIGHEST_PROTOCOL)
+			os.rename(temp, self.get_path(key))
+		except:
+			os.unlink(temp)
+			raise
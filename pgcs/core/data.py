@@ -1,29 +1,209 @@
+import hashlib
+
 FLAG_VALUE   = 0x0
 FLAG_OBJECT  = 0x1
 FLAG_LIST    = 0x2
 FLAG_DICT    = 0x4
 FLAG_KEY     = 0x8
 
-unknown = object()
+class Unknown(object):
+	# Pickles by reference so that identity checks survive a cache round trip
+	def __reduce__(self):
+		return "unknown"
+
+unknown = Unknown()
+
+# A text of which only a digest has been loaded.  Texts compare by digest,
+# and are fetched from the loader when converted to strings.
+
+empty_digest = "d41d8cd98f00b204e9800998ecf8427e"
+
+class Deferred(object):
+	def __init__(self, loader, key, digest):
+		self.loader = loader
+		self.key = key
+		self.digest = digest
+
+	def __eq__(self, other):
+		return isinstance(other, Deferred) and self.digest == other.digest
+
+	def __ne__(self, other):
+		return not self.__eq__(other)
+
+	def __hash__(self):
+		return hash(self.digest)
+
+	def __nonzero__(self):
+		return self.digest != empty_digest
+
+	def __str__(self):
+		return self.loader.get_text(self)
+
+	def __unicode__(self):
+		return unicode(str(self))
+
+# Fetches the texts of the deferred values at once
+
+def fetch_deferred(values):
+	deferred = {}
+	for value in values:
+		if isinstance(value, Deferred):
+			deferred.setdefault(value.loader, []).append(value)
+
+	for loader, loader_values in deferred.iteritems():
+		loader.fetch(loader_values)
+
+# Equal strings and keys of all loaded databases are shared, so that each is
+# kept in memory once however many databases are loaded, and so that equal
+# values compare as identical at once.  Interned strings are freed with their
+# last reference.  The keys are shared between the databases loaded together,
+# and the table is cleared when they have been loaded.
+
+_keys = {}
+
+def intern_value(value):
+	if type(value) is str:
+		return intern(value)
+	return value
+
+# The value at index raw is left as it is
+def intern_row(row, raw=None):
+	if raw is None:
+		return tuple([intern_value(value) for value in row])
+	else:
+		return tuple([value if i == raw else intern_value(value) for i, value in enumerate(row)])
+
+def intern_key(key):
+	return _keys.setdefault(key, key)
+
+def clear_keys():
+	_keys.clear()
+
+# Data objects keep their values in slots instead of a dict per object.  A
+# class which doesn't define __slots__ gets one slot for each of its own
+# value_info names and extra_slots.
+
+class DataType(type):
+	def __new__(cls, name, bases, namespace):
+		if "__slots__" not in namespace:
+			inherited = set()
+			for base in bases:
+				inherited.update(getattr(base, "slot_names", ()))
+
+			names = [n for n, flags in namespace.get("value_info", [])]
+			names += namespace.get("extra_slots", [])
+			namespace["__slots__"] = tuple([n for n in names if n not in inherited])
+
+		datatype = type.__new__(cls, name, bases, namespace)
+
+		datatype.value_names = frozenset([n for n, flags in getattr(datatype, "value_info", ())])
+
+		# Names of the slots which are pickled
+		datatype.slot_names = tuple([n for c in reversed(datatype.__mro__)
+		                               for n in c.__dict__.get("__slots__", ())
+		                               if not n.startswith("__")])
+
+		return datatype
+
+# Values are compared by a digest of the same fields that equal_values()
+# compares.  Referenced objects are covered by their keys, not their digests,
+# so that equality stays shallow.  When check_digests is set, every digest
+# comparison is verified with a full one.
+
+check_digests = False
+
+def canonical(value):
+	if isinstance(value, (tuple, list)):
+		return tuple([canonical(v) for v in value])
+	elif isinstance(value, Deferred):
+		return (Deferred, value.digest)
+	elif isinstance(value, (int, long)):
+		return int(value)
+	else:
+		return value
+
+# Loaded databases are frozen: their list and dict values are replaced with
+# tuples and FrozenDicts, the digests and keys are computed, and setting a
+# value raises FrozenError.  Frozen objects can be shared between threads.
+# They must be thawed before they are modified again.
+
+class FrozenError(TypeError):
+	pass
+
+class FrozenDict(dict):
+	def __readonly(self, *args, **kwargs):
+		raise FrozenError("Frozen dict can't be modified")
+
+	__setitem__ = __delitem__ = __readonly
+	clear = pop = popitem = setdefault = update = __readonly
 
 class Data(object):
+	__metaclass__ = DataType
+	__slots__ = ("__digest", "__flat", "__frozen")
+
 	def __init__(self):
+		self.__frozen = False
+
 		for name, flags in self.value_info:
 			if flags & FLAG_LIST:
 				setattr(self, name, [])
 			elif flags & FLAG_DICT:
 				setattr(self, name, {})
 			else:
-				# TODO: use __slots__ instead
 				setattr(self, name, None)
 
-		self.__hashcode = None
+		self.__digest = None
+		self.__flat = None
+
+	def __setattr__(self, name, value):
+		if name in self.value_names and self.__frozen:
+			raise FrozenError("Frozen %s can't be modified" % type(self).__name__)
+		object.__setattr__(self, name, value)
+
+	# The cached digest and key aren't pickled, and unpickled objects aren't
+	# frozen
+	def __getstate__(self):
+		state = dict(getattr(self, "__dict__", ()))
+		for name in self.slot_names:
+			if hasattr(self, name):
+				value = getattr(self, name)
+				if type(value) is FrozenDict:
+					value = dict(value)
+				state[name] = value
+		return state
+
+	def __setstate__(self, state):
+		self.__frozen = False
+		self.__digest = None
 		self.__flat = None
+		for name, value in state.iteritems():
+			setattr(self, name, value)
 
+	# Objects which are still being loaded are compared by their values and
+	# hashed by identity, since their values change after they have been put
+	# in sets
 	def __eq__(self, other):
 		if other is None or not isinstance(other, Data):
 			return False
 
+		if not (self.__frozen and other.__frozen):
+			return self.equal_values(other)
+
+		equal = self.value_digest() == other.value_digest()
+		if check_digests:
+			assert equal == self.equal_values(other), (self, other)
+		return equal
+
+	def __ne__(self, other):
+		return not self.__eq__(other)
+
+	def __hash__(self):
+		if not self.__frozen:
+			return object.__hash__(self)
+
+		return hash(self.value_digest())
+
+	def equal_values(self, other):
 		for name, flags in self.value_info:
 			value1 = getattr(self, name)
 			value2 = getattr(other, name)
@@ -47,21 +227,22 @@ class Data(object):
 
 		return True
 
-	def __ne__(self, other):
-		return not self.__eq__(other)
-
-	def __hash__(self):
-		if self.__hashcode is None:
-			hashcode = 0
+	# The digest is cached only when the object is frozen
+	def value_digest(self):
+		digest = self.__digest
+		if digest is None:
+			values = []
 
 			for name, flags in self.value_info:
 				value = getattr(self, name)
 				value = self.__freeze(value, flags)
-				hashcode ^= hash(value)
+				values.append(canonical(value))
 
-			self.__hashcode = hashcode
+			digest = hashlib.md5(repr(tuple(values))).digest()
+			if self.__frozen:
+				self.__digest = digest
 
-		return self.__hashcode
+		return digest
 
 	def flatten(self):
 		if self.__flat is None:
@@ -73,7 +254,7 @@ class Data(object):
 					value = self.__freeze(value, flags)
 					flat.append(value)
 
-			self.__flat = tuple(flat)
+			self.__flat = intern_key(tuple(flat))
 
 		return self.__flat
 
@@ -97,17 +278,146 @@ class Data(object):
 	def get_name(self):
 		return self.flatten()[-1]
 
+	# Must be called after the values have been modified
+	def invalidate(self):
+		self.__digest = None
+		self.__flat = None
+
+	def freeze(self):
+		for name, flags in self.value_info:
+			if flags & FLAG_LIST:
+				setattr(self, name, tuple(getattr(self, name)))
+			elif flags & FLAG_DICT:
+				setattr(self, name, FrozenDict(getattr(self, name)))
+
+		self.__frozen = True
+
+	def thaw(self):
+		self.__frozen = False
+
+		for name, flags in self.value_info:
+			if flags & FLAG_LIST:
+				setattr(self, name, list(getattr(self, name)))
+			elif flags & FLAG_DICT:
+				setattr(self, name, dict(getattr(self, name)))
+
+no_xrefs = frozenset()
+
 class XReferee(Data):
+	__slots__ = ("_xrefs",)
+
 	def __init__(self):
 		Data.__init__(self)
-		self.xrefs = set()
+		self._xrefs = None
+
+	# Most objects are never referred to, so the set is allocated when the
+	# first referer is added
+	@property
+	def xrefs(self):
+		return self._xrefs or no_xrefs
+
+	@xrefs.setter
+	def xrefs(self, xrefs):
+		self._xrefs = xrefs or None
+
+	def add_xref(self, source):
+		if self._xrefs is None:
+			self._xrefs = set()
+		self._xrefs.add(source)
+
+	def discard_xref(self, source):
+		if self._xrefs is not None:
+			self._xrefs.discard(source)
+
+	# The referers are hashed differently when they are frozen, so the set is
+	# rebuilt after all of them have been frozen or thawed.  Sets copied from
+	# sets keep the old hashes of the items.
+	def rehash_xrefs(self, settype):
+		if self._xrefs:
+			self._xrefs = settype(list(self._xrefs))
+
+	# The referers may not be fully unpickled when this object is, so the
+	# set is stored as a list and rebuilt later by relink().
+	def __getstate__(self):
+		state = Data.__getstate__(self)
+		if self._xrefs is not None:
+			state["_xrefs"] = list(self._xrefs)
+		return state
 
 def xref(source, target):
 	if isinstance(target, (tuple, list, set)):
 		for t in target:
-			t.xrefs.add(source)
+			t.add_xref(source)
 	elif target is not None:
-		target.xrefs.add(source)
+		target.add_xref(source)
+
+def unxref(source, target):
+	if isinstance(target, (tuple, list, set)):
+		for t in target:
+			t.discard_xref(source)
+	elif target is not None:
+		target.discard_xref(source)
+
+def relink(*roots):
+	for obj in walk(*roots):
+		if isinstance(obj, XReferee) and not isinstance(obj.xrefs, set):
+			obj.xrefs = set(obj.xrefs)
+
+# The keys may have been computed while the objects were linked to each
+# other, before they were complete, so everything is computed again
+
+def freeze(*roots):
+	objects = list(walk(*roots))
+
+	for obj in objects:
+		obj.invalidate()
+
+	for obj in objects:
+		obj.freeze()
+
+	for obj in objects:
+		obj.flatten()
+		obj.value_digest()
+
+	for obj in objects:
+		if isinstance(obj, XReferee):
+			obj.rehash_xrefs(frozenset)
+
+def thaw(*roots):
+	objects = list(walk(*roots))
+
+	for obj in objects:
+		obj.thaw()
+		obj.invalidate()
+
+	for obj in objects:
+		if isinstance(obj, XReferee):
+			obj.rehash_xrefs(set)
+
+def walk(*roots):
+	seen = set()
+	stack = list(roots)
+
+	while stack:
+		obj = stack.pop()
+		if id(obj) in seen:
+			continue
+
+		seen.add(id(obj))
+		yield obj
+
+		for name, flags in obj.value_info:
+			if flags & FLAG_OBJECT:
+				value = getattr(obj, name)
+				if flags & FLAG_LIST:
+					stack.extend(value)
+				elif flags & FLAG_DICT:
+					stack.extend(value.values())
+				elif value is not None:
+					stack.append(value)
+
+		if isinstance(obj, XReferee):
+			stack.extend(obj.xrefs)
 
 def flatten(data):
 	if data is None:
@@ -124,11 +434,20 @@ class Database(Data):
 		("namespaces",  FLAG_OBJECT | FLAG_LIST),
 	]
 
+	# The loaders attach stats and catalog objects
+	extra_slots = ["__dict__"]
+
+	# Set when the source isn't a DSN string
+	name = None
+
 	def __init__(self, source):
 		Data.__init__(self)
 		self.source = source
 
 	def get_name(self):
+		if self.name:
+			return self.name
+
 		for token in self.source.split():
 			key, value = token.split("=", 1)
 			if key == "dbname":
@@ -163,12 +482,17 @@ class Namespace(Data):
 		("functions",   FLAG_OBJECT | FLAG_LIST),
 		("operators",   FLAG_OBJECT | FLAG_LIST),
 		("opclasses",   FLAG_OBJECT | FLAG_LIST),
+		("digest",      FLAG_VALUE),
 	]
 
 	def __init__(self, *values):
 		Data.__init__(self)
 		self.name, self.owner = values
 
+	# A namespace which was found identical in all databases is represented
+	# by its digest instead of its objects
+	def init_digest(self, digest):
+		self.digest = digest
 
 	def is_internal(self):
 		return self.name.startswith("pg_") or self.name == "information_schema"
@@ -227,6 +551,20 @@ class Function(XReferee):
 		args = [type.name for type in self.argtypes or ()]
 		return "%s(%s)" % (self.name, ", ".join(args))
 
+# PL/pgSQL sources are compared without indentation and blank lines
+
+def trim_function(language_name, source):
+	if language_name == "plpgsql":
+		buf = ""
+		for line in source.split("\n"):
+			line = line.strip()
+			if line:
+				if buf:
+					buf += " "
+				buf += line
+		source = buf
+	return source
+
 # Relation
 
 class Relation(XReferee):
@@ -237,9 +575,29 @@ class Relation(XReferee):
 		("columns",     FLAG_OBJECT | FLAG_DICT),
 	]
 
+	# The names of the columns in attnum order, cached as an interned key so
+	# that the diff can compare relations without sorting their columns.  It
+	# is kept in addition to the Column objects.
+	extra_slots = ["column_names"]
+
 	def __init__(self, *values):
 		XReferee.__init__(self)
 		self.namespace, self.name, self.owner = values
+		self.column_names = None
+
+	def freeze(self):
+		XReferee.freeze(self)
+		self.column_names = intern_key(tuple([self.columns[n].name for n in sorted(self.columns)]))
+
+	def thaw(self):
+		XReferee.thaw(self)
+		self.column_names = None
+
+	# The names are computed again when the relation is frozen
+	def __getstate__(self):
+		state = XReferee.__getstate__(self)
+		state.pop("column_names", None)
+		return state
 
 class Composite(Relation):
 	pass
@@ -265,6 +623,8 @@ class Table(RuleRelation):
 		("constraints", FLAG_OBJECT | FLAG_LIST),
 	]
 
+	extra_slots = ["has_content"]
+
 	def __init__(self, *values):
 		RuleRelation.__init__(self, *values)
 		self.has_content = unknown
@@ -1,5 +1,11 @@
+import copy
+import cPickle
+import cStringIO
 import difflib
 import functools
+import hashlib
+import multiprocessing
+import os
 
 from . import data
 
@@ -11,6 +17,9 @@ def similar(a, b):
 	else:
 		return different
 
+def differ(objects):
+	return functools.reduce(similar, objects) is different
+
 def xgetattr(obj, attr):
 	if obj is None:
 		return None
@@ -23,41 +32,72 @@ def parse(objects, kwargs):
 		objects = [xgetattr(obj, attr) for obj in objects]
 	return objects
 
+# Lists of flattened objects are grouped by equal tuples
+
+def group_key(value):
+	if isinstance(value, list):
+		return list, tuple(value)
+	else:
+		return value
+
+def find_group(prototypes, obj, count):
+	for prototype, group in prototypes:
+		if obj == prototype:
+			return group
+
+	prototypes.append((obj, count))
+	return count
+
+# Groups are numbered in the order of their first values.  Values which can't
+# be hashed are compared with the first values of their groups.
+
 class Value(object):
 	def __init__(self, values=None, **kwargs):
 		values = parse(values, kwargs)
 
 		self.values = []
 
+		groups = {}
 		prototypes = []
+		count = 0
 
 		for obj in values:
 			group = -1
 
 			if obj is not None:
-				found = False
+				try:
+					group = groups.setdefault(group_key(obj), count)
+				except TypeError:
+					group = find_group(prototypes, obj, count)
 
-				for group in xrange(len(prototypes)):
-					if obj == prototypes[group]:
-						found = True
-						break
-
-				if not found:
-					group = len(prototypes)
-					prototypes.append(obj)
+				if group == count:
+					count += 1
 
 			self.values.append((obj, group))
 
-		self.groups = len(prototypes)
+		self.groups = count
 
 	def __nonzero__(self):
 		return self.groups > 1
 
+	# Returns a copy for all objects, given the class of each object and its
+	# own values.  The groups are those of the representatives.
+	def expand(self, classes, values):
+		value = copy.copy(self)
+		value.values = [(obj, self.values[c][1]) for obj, c in zip(values, classes)]
+		return value
+
 class ObjectValue(Value):
 	def __init__(self, objects=None, **kwargs):
 		self.objects = parse(objects, kwargs)
 		Value.__init__(self, [data.flatten(obj) for obj in self.objects])
 
+	def expand(self, classes, objects):
+		value = copy.copy(self)
+		value.values = [self.values[c] for c in classes]
+		value.objects = objects
+		return value
+
 class ObjectListValue(Value):
 	def __init__(self, lists=None, **kwargs):
 		def flatten_seq(seq):
@@ -69,21 +109,34 @@ class ObjectListValue(Value):
 		lists = parse(lists, kwargs)
 		Value.__init__(self, [flatten_seq(seq) for seq in lists])
 
+	def expand(self, classes, lists):
+		value = copy.copy(self)
+		value.values = [self.values[c] for c in classes]
+		return value
+
 class OrderedObjectList(ObjectListValue):
 	def __init__(self, lists=None, **kwargs):
 		self.lists = parse(lists, kwargs)
 		ObjectListValue.__init__(self, self.lists)
 
+	def expand(self, classes, lists):
+		value = ObjectListValue.expand(self, classes, lists)
+		value.lists = lists
+		return value
+
+def map_values(map):
+	if map is None:
+		return None
+	else:
+		return [map[i] for i in sorted(map)]
+
 class IndexedObjectList(OrderedObjectList):
 	def __init__(self, maps=None, **kwargs):
-		def flatten_map(map):
-			if map is None:
-				return None
-			else:
-				return [map[i] for i in sorted(map)]
-
 		maps = parse(maps, kwargs)
-		OrderedObjectList.__init__(self, [flatten_map(map) for map in maps])
+		OrderedObjectList.__init__(self, [map_values(map) for map in maps])
+
+	def expand(self, classes, maps):
+		return OrderedObjectList.expand(self, classes, [map_values(map) for map in maps])
 
 class NamedEntry(object):
 	def __init__(self, name, objects=None, **kwargs):
@@ -102,12 +155,20 @@ class NamedEntry(object):
 					break
 
 		if kind:
-			self.diff = diff_types[kind](self.objects)
+			self.diff = make_diff(diff_types[kind], self.objects)
 		else:
 			self.diff = None
 
 	def __nonzero__(self):
-		return functools.reduce(similar, self.objects) is different
+		return differ(self.objects)
+
+	def expand(self, classes, objects):
+		entry = copy.copy(self)
+		entry.objects = objects
+		entry.value = self.value.expand(classes, objects)
+		if self.diff is not None:
+			entry.diff = type(self.diff)(objects, self.diff, classes)
+		return entry
 
 class NamedObjectList(object):
 	def __init__(self, _sequences=None, **kwargs):
@@ -127,89 +188,255 @@ class NamedObjectList(object):
 
 		maps = [name_map(seq) for seq in sequences]
 
+		# Most objects are identical, so they are compared before their
+		# entries and sub-diffs are built
 		for name in sorted(names):
-			entry = NamedEntry(name, [map.get(name) for map in maps])
-			if entry:
-				self.entries.append(entry)
+			objects = [map.get(name) for map in maps]
+			if differ(objects):
+				self.entries.append(NamedEntry(name, objects))
 
 	def __nonzero__(self):
 		return bool(self.entries)
 
+	# The objects of the other databases are found by the names of the
+	# representatives' objects, at the same positions in their lists unless
+	# the lists are ordered differently.  A name which several objects share
+	# is looked up in each list, since the last of them is the one compared.
+	def expand(self, classes, sequences):
+		positions = {}
+		for i, c in enumerate(classes):
+			if c not in positions:
+				positions[c] = position_map(sequences[i])
+
+		maps = {}
+
+		def find(i, name):
+			n = positions[classes[i]].get(name)
+			if n is None:
+				return None
+
+			if n >= 0:
+				obj = sequences[i][n]
+				if obj.get_name() == name:
+					return obj
+
+			if i not in maps:
+				maps[i] = dict((o.get_name(), o) for o in sequences[i])
+			return maps[i][name]
+
+		value = copy.copy(self)
+		value.entries = [entry.expand(classes, [find(i, entry.name) for i in xrange(len(classes))])
+		                 for entry in self.entries]
+		return value
+
+# Maps the names of a list to the positions of their objects, or to -1 if
+# several objects have the name
+
+def position_map(seq):
+	positions = {}
+	for n, obj in enumerate(seq or ()):
+		name = obj.get_name()
+		if name in positions:
+			positions[name] = -1
+		else:
+			positions[name] = n
+	return positions
+
+# Databases are often copies of a few schema versions.  Databases and
+# namespaces are put in classes by digests of everything which their diffs
+# compare, and only one representative of each class is compared.  The
+# digests are built from the value digests which freeze has computed, and the
+# objects of the named lists are sorted by their digests since the lists are
+# compared by name.  Of the objects which share a name only the last one is
+# compared.  The sources of the databases aren't compared.
+
+def tree_digest(obj):
+	names = named_lists[type(obj)]
+	if not names:
+		return obj.value_digest()
+
+	if isinstance(obj, data.Database):
+		parts = []
+	else:
+		parts = [obj.value_digest()]
+
+	for name in names:
+		seq = getattr(obj, name)
+		if seq:
+			objects = dict((o.get_name(), o) for o in seq)
+			parts.append("%s:%d:" % (name, len(objects)))
+			parts.extend(sorted([tree_digest(o) for o in objects.itervalues()]))
+
+	if len(parts) == 1:
+		return parts[0]
+	else:
+		return hashlib.md5("".join(parts)).digest()
+
+# Returns the representatives and the class of each object, or None instead of
+# the classes if every object is in a class of its own
+
+def cluster(objects):
+	if len(objects) <= 2:
+		return objects, None
+
+	classes = []
+	representatives = []
+	numbers = {}
+
+	for obj in objects:
+		if obj is None:
+			key = None
+		else:
+			key = tree_digest(obj)
+
+		number = numbers.setdefault(key, len(representatives))
+		if number == len(representatives):
+			representatives.append(obj)
+
+		classes.append(number)
+
+	if len(representatives) == len(objects):
+		return objects, None
+
+	return representatives, classes
+
+def make_diff(kind, objects):
+	if kind.clustered:
+		representatives, classes = cluster(objects)
+		if classes is not None:
+			return kind(objects, kind(representatives), classes)
+
+	return kind(objects)
+
+# The attributes listed in diff_info are computed when they are first read.
+# Value and list classes are given the objects and the attribute name, and
+# functions just the objects.
+#
+# The attributes of a diff of clustered objects are those of the diff of the
+# representatives, expanded to the objects of all classes.  The first object
+# of each group is a representative, so the groups show the same objects
+# either way.
+
 class Any(object):
-	def __init__(self, objects):
+	diff_info = []
+	clustered = False
+
+	def __init__(self, objects, base=None, classes=None):
 		self.objects = objects
+		self.base = base
+		self.classes = classes
+
+	def __getattr__(self, name):
+		kind = dict(self.diff_info).get(name)
+		if kind is None:
+			raise AttributeError(name)
+
+		if self.base is not None:
+			value = getattr(self.base, name)
+			if value is not None:
+				value = value.expand(self.classes, [xgetattr(obj, name) for obj in self.objects])
+		elif isinstance(kind, type):
+			value = kind(**{name: self.objects}) or None
+		else:
+			value = kind(self.objects)
+
+		setattr(self, name, value)
+		return value
 
 	def __nonzero__(self):
-		for key, value in self.__dict__.iteritems():
-			if key != "objects" and value:
+		if self.base is not None:
+			return bool(self.base)
+
+		for name, kind in self.diff_info:
+			if getattr(self, name):
 				return True
 		return False
 
+	# The diff of the representatives isn't pickled once all attributes have
+	# been computed
+	def __getstate__(self):
+		state = dict(self.__dict__)
+		if all([name in state for name, kind in self.diff_info]):
+			state["base"] = None
+		return state
+
 # Database
 
 class Database(Any):
-	def __init__(self, objects):
-		Any.__init__(self, objects)
-		self.languages = NamedObjectList(languages=objects) or None
-		self.namespaces = NamedObjectList(namespaces=objects) or None
+	clustered = True
+	diff_info = [
+		("languages",   NamedObjectList),
+		("namespaces",  NamedObjectList),
+	]
 
 # Language
 
 class Language(Any):
-	def __init__(self, objects):
-		Any.__init__(self, objects)
-		self.owner = Value(owner=objects) or None
+	diff_info = [
+		("owner",       Value),
+	]
 
 # Namespace
 
 class Namespace(Any):
-	def __init__(self, objects):
-		Any.__init__(self, objects)
-		self.owner = Value(owner=objects) or None
-		self.types = NamedObjectList(types=objects) or None
-		self.composites = NamedObjectList(composites=objects) or None
-		self.indexes = NamedObjectList(indexes=objects) or None
-		self.tables = NamedObjectList(tables=objects) or None
-		self.views = NamedObjectList(views=objects) or None
-		self.sequences = NamedObjectList(sequences=objects) or None
-		self.functions = NamedObjectList(functions=objects) or None
-		self.operators = NamedObjectList(operators=objects) or None
-		self.opclasses = NamedObjectList(opclasses=objects) or None
+	clustered = True
+	diff_info = [
+		("owner",       Value),
+		("types",       NamedObjectList),
+		("composites",  NamedObjectList),
+		("indexes",     NamedObjectList),
+		("tables",      NamedObjectList),
+		("views",       NamedObjectList),
+		("sequences",   NamedObjectList),
+		("functions",   NamedObjectList),
+		("operators",   NamedObjectList),
+		("opclasses",   NamedObjectList),
+	]
 
 # Type
 
 class Type(Any):
-	def __init__(self, objects):
-		Any.__init__(self, objects)
-		self.owner = Value(owner=objects) or None
-		self.notnull = Value(notnull=objects) or None
-		self.default = Value(default=objects) or None
+	diff_info = [
+		("owner",       Value),
+		("notnull",     Value),
+		("default",     Value),
+	]
 
 class Domain(Type):
-	def __init__(self, objects):
-		Type.__init__(self, objects)
-		self.basetype = ObjectValue(basetype=objects) or None
-		self.constraints = NamedObjectList(constraints=objects) or None
+	diff_info = Type.diff_info + [
+		("basetype",    ObjectValue),
+		("constraints", NamedObjectList),
+	]
 
 # Function
 
 class Function(Any):
-	def __init__(self, objects):
-		Any.__init__(self, objects)
-		self.owner = Value(owner=objects) or None
-		self.language = ObjectValue(language=objects) or None
-		self.rettype = ObjectValue(rettype=objects) or None
-		self.argtypes = ObjectListValue(argtypes=objects) or None
-		self.source1 = Value(source1=objects) or None
-		self.source2 = Value(source2=objects) or None
+	diff_info = [
+		("owner",       Value),
+		("language",    ObjectValue),
+		("rettype",     ObjectValue),
+		("argtypes",    ObjectListValue),
+		("source1",     Value),
+		("source2",     Value),
+	]
 
 # Relation
 
+# Columns are compared by their names in attnum order, so relations with equal
+# name keys need no column lists
+
+def diff_columns(relations):
+	names = [xgetattr(r, "column_names") for r in relations if r is not None]
+	if None not in names and len(set(names)) <= 1:
+		return None
+
+	return IndexedObjectList(columns=relations) or None
+
 class Relation(Any):
-	def __init__(self, objects):
-		Any.__init__(self, objects)
-		self.owner = Value(owner=objects) or None
-		self.columns = IndexedObjectList(columns=objects) or None
+	diff_info = [
+		("owner",       Value),
+		("columns",     diff_columns),
+	]
 
 class Composite(Relation):
 	pass
@@ -218,15 +445,15 @@ class Index(Relation):
 	pass
 
 class RuleRelation(Relation):
-	def __init__(self, objects):
-		Relation.__init__(self, objects)
-		self.rules = NamedObjectList(rules=objects) or None
+	diff_info = Relation.diff_info + [
+		("rules",       NamedObjectList),
+	]
 
 class Table(RuleRelation):
-	def __init__(self, objects):
-		RuleRelation.__init__(self, objects)
-		self.triggers = NamedObjectList(triggers=objects) or None
-		self.constraints = NamedObjectList(constraints=objects) or None
+	diff_info = RuleRelation.diff_info + [
+		("triggers",    NamedObjectList),
+		("constraints", NamedObjectList),
+	]
 
 class View(RuleRelation):
 	pass
@@ -234,29 +461,29 @@ class View(RuleRelation):
 # Sequence
 
 class Sequence(Any):
-	def __init__(self, objects):
-		Any.__init__(self, objects)
-		self.owner = Value(owner=objects) or None
-		self.increment = Value(increment=objects) or None
-		self.minimum = Value(minimum=objects) or None
-		self.maximum = Value(maximum=objects) or None
+	diff_info = [
+		("owner",       Value),
+		("increment",   Value),
+		("minimum",     Value),
+		("maximum",     Value),
+	]
 
 # Column
 
 class Column(Any):
-	def __init__(self, objects):
-		Any.__init__(self, objects)
-		self.name = Value(name=objects) or None
-		self.type = ObjectValue(type=objects) or None
-		self.notnull = Value(notnull=objects) or None
-		self.default = Value(default=objects) or None
+	diff_info = [
+		("name",        Value),
+		("type",        ObjectValue),
+		("notnull",     Value),
+		("default",     Value),
+	]
 
 # Constraint
 
 class Constraint(Any):
-	def __init__(self, objects):
-		Any.__init__(self, objects)
-		self.definition = Value(definition=objects) or None
+	diff_info = [
+		("definition",  Value),
+	]
 
 class CheckConstraint(Constraint):
 	pass
@@ -265,9 +492,9 @@ class UniqueConstraint(Constraint):
 	pass
 
 class ColumnConstraint(Constraint):
-	def __init__(self, objects):
-		Constraint.__init__(self, objects)
-		self.columns = OrderedObjectList(columns=objects) or None
+	diff_info = Constraint.diff_info + [
+		("columns",     OrderedObjectList),
+	]
 
 class CheckColumnConstraint(ColumnConstraint):
 	pass
@@ -279,46 +506,47 @@ class PrimaryKey(ColumnConstraint):
 	pass
 
 class ForeignKey(ColumnConstraint):
-	def __init__(self, objects):
-		ColumnConstraint.__init__(self, objects)
-		self.foreign_table = ObjectValue(foreign_table=objects) or None
-		self.foreign_columns = OrderedObjectList(foreign_columns=objects) or None
+	diff_info = ColumnConstraint.diff_info + [
+		("foreign_table", ObjectValue),
+		("foreign_columns", OrderedObjectList),
+	]
 
 # Trigger
 
 class Trigger(Any):
-	def __init__(self, objects):
-		Any.__init__(self, objects)
-		self.function = ObjectValue(function=objects) or None
-		self.description = Value(description=objects) or None
+	diff_info = [
+		("function",    ObjectValue),
+		("description", Value),
+	]
 
 # Rule
 
 class Rule(Any):
-	def __init__(self, objects):
-		Any.__init__(self, objects)
-		self.definition = Value(definition=objects) or None
+	diff_info = [
+		("definition",  Value),
+	]
 
 # Operator
 
 class Operator(Any):
-	def __init__(self, objects):
-		Any.__init__(self, objects)
-		self.owner = Value(owner=objects) or None
+	diff_info = [
+		("owner",       Value),
+	]
 
 class OperatorClass(Any):
-	def __init__(self, objects):
-		Any.__init__(self, objects)
-		self.owner = Value(owner=objects) or None
-		self.intype = ObjectValue(intype=objects) or None
-		self.default = Value(default=objects) or None
-		self.keytype = ObjectValue(keytype=objects) or None
+	diff_info = [
+		("owner",       Value),
+		("intype",      ObjectValue),
+		("default",     Value),
+		("keytype",     ObjectValue),
+	]
 
 diff_types = {
 	data.CheckColumnConstraint: CheckColumnConstraint,
 	data.CheckConstraint: CheckConstraint,
 	data.Column: Column,
 	data.Composite: Composite,
+	data.Database: Database,
 	data.Domain: Domain,
 	data.ForeignKey: ForeignKey,
 	data.Function: Function,
@@ -338,5 +566,120 @@ diff_types = {
 	data.View: View,
 }
 
-def diff_databases(objects):
-	return Database(objects)
+# The names of the named lists of each type of objects
+named_lists = dict([(datatype, [name for name, value in kind.diff_info if value is NamedObjectList])
+                    for datatype, kind in diff_types.iteritems()])
+
+def diff_databases(objects, processes=None):
+	diff = make_diff(Database, objects)
+	if processes > 1 and hasattr(os, "fork"):
+		diff_namespaces(diff, processes)
+	return diff
+
+# The object lists of the differing namespaces are compared in forked worker
+# processes.  The results refer to the objects of the databases by their ids,
+# which are the same in the workers, and are attached to the namespace diffs
+# in order.
+
+_database_diff = None
+
+def diff_namespaces(diff, processes):
+	global _database_diff
+
+	if not diff.namespaces:
+		return
+
+	tasks = [(i, name) for i, entry in enumerate(diff.namespaces.entries)
+	         if entry.diff is not None
+	         for name, kind in entry.diff.diff_info]
+
+	_database_diff = diff
+	pool = multiprocessing.Pool(processes)
+	try:
+		results = pool.map(diff_namespace_list, tasks)
+		pool.close()
+	finally:
+		pool.terminate()
+		_database_diff = None
+
+	shared = SharedObjects(diff.objects)
+
+	for (i, name), result in zip(tasks, results):
+		unpickler = cPickle.Unpickler(cStringIO.StringIO(result))
+		unpickler.persistent_load = shared.get
+		setattr(diff.namespaces.entries[i].diff, name, unpickler.load())
+
+def diff_namespace_list(task):
+	i, name = task
+	value = getattr(_database_diff.namespaces.entries[i].diff, name)
+	complete(value)
+
+	file = cStringIO.StringIO()
+	pickler = cPickle.Pickler(file, cPickle.HIGHEST_PROTOCOL)
+	pickler.persistent_id = get_shared_id
+	pickler.dump(value)
+	return file.getvalue()
+
+def get_shared_id(obj):
+	if isinstance(obj, (data.Data, data.Deferred)):
+		return id(obj)
+	else:
+		return None
+
+# Finds the objects of the databases by id.  The deferred texts are looked
+# up only if a result refers to one.
+
+class SharedObjects(object):
+	def __init__(self, databases):
+		self.objects = dict((id(obj), obj) for obj in data.walk(*databases))
+		self.deferred = None
+
+	def get(self, obj_id):
+		obj = self.objects.get(obj_id)
+		if obj is not None:
+			return obj
+
+		if self.deferred is None:
+			self.deferred = {}
+			for obj in self.objects.itervalues():
+				for name, flags in obj.value_info:
+					value = getattr(obj, name)
+					if isinstance(value, data.Deferred):
+						self.deferred[id(value)] = value
+
+		return self.deferred[obj_id]
+
+# Computes the lazy attributes of a diff and everything under it
+
+def complete(diff):
+	if isinstance(diff, NamedObjectList):
+		for entry in diff.entries:
+			if entry.diff is not None:
+				complete(entry.diff)
+	elif isinstance(diff, Any):
+		for name, kind in diff.diff_info:
+			complete(getattr(diff, name))
+
+# Yields the values which differ, and the plain values of the objects in
+# differing lists
+
+def get_values(diff):
+	for name, kind in diff.diff_info:
+		value = getattr(diff, name)
+
+		if isinstance(value, Value):
+			for obj, group in value.values:
+				yield obj
+
+		if isinstance(value, OrderedObjectList):
+			for seq in value.lists:
+				for obj in seq or ():
+					for name, flags in obj.value_info:
+						if not flags & data.FLAG_OBJECT:
+							yield getattr(obj, name)
+
+		if isinstance(value, NamedObjectList):
+			for entry in value.entries:
+				if entry.diff is not None:
+					for v in get_values(entry.diff):
+						yield v
@@ -0,0 +1,1093 @@
+import gzip
+import os
+import re
+import subprocess
+import tarfile
+
+from . import data
+from . import stats
+
+# Builds the object graph of a database from the output of pg_dump
+# --schema-only instead of the system catalogs, so that no server is needed.
+# Plain SQL dumps are parsed as they are; custom, tar and directory format
+# archives are converted to SQL with pg_restore, which doesn't connect to a
+# server either.
+#
+# A dump doesn't tell everything the catalogs do, so a dump compares equal
+# to another dump of the same schema, but not necessarily to the database
+# itself.  Left out or unknown are:
+#   - the content of tables
+#   - the columns of views (their types aren't written out)
+#   - the columns of index expressions
+#   - the objects which belong to extensions
+#   - the owners of objects dumped with --no-owner
+
+class DumpError(Exception):
+	pass
+
+def is_dump(source):
+	return os.path.isfile(source) or os.path.isfile(os.path.join(source, "toc.dat"))
+
+def get_dump_name(path):
+	name = os.path.basename(os.path.normpath(path))
+	for extension in (".gz", ".sql", ".dump", ".tar"):
+		if name.endswith(extension):
+			name = name[:-len(extension)]
+	return name
+
+def load_dump(path, ignored, stats_callback=None):
+	db = data.Database(path)
+	db.name = get_dump_name(path)
+	statistics = db.stats = stats.Stats(db.name, stats_callback)
+
+	with statistics.measure("read"):
+		text = read_dump(path)
+
+	with statistics.measure("statements") as phase:
+		loader = Loader(db, ignored, get_server_version(text))
+		for statement in split_statements(text):
+			try:
+				if loader.execute(statement):
+					phase.objects += 1
+			except DumpError, e:
+				raise DumpError("%s: %s" % (path, e))
+			phase.rows += 1
+
+	with statistics.measure("freeze"):
+		data.freeze(db)
+
+	return db
+
+def read_dump(path):
+	if os.path.isfile(path):
+		with open(path, "rb") as file:
+			magic = file.read(5)
+
+		if magic.startswith("\x1f\x8b"):
+			with gzip.open(path, "rb") as file:
+				return file.read()
+
+		if magic != "PGDMP" and not tarfile.is_tarfile(path):
+			with open(path, "rb") as file:
+				return file.read()
+
+	try:
+		process = subprocess.Popen(["pg_restore", "--schema-only", path],
+		                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	except OSError, e:
+		raise DumpError("%s: Can't run pg_restore: %s" % (path, e))
+
+	text, errors = process.communicate()
+	if process.returncode:
+		raise DumpError("%s: pg_restore failed: %s" % (path, errors.strip()))
+	return text
+
+# The version of the server is needed for the objects which the server
+# creates implicitly; without the header the dump is assumed to be recent
+
+version_pattern = re.compile(r"^-- Dumped from database version (\d+)\.(\d+)(?:\.(\d+))?", re.M)
+
+def get_server_version(text):
+	match = version_pattern.search(text, 0, 4096)
+	if match is None:
+		return None
+
+	major, minor, patch = [int(n or 0) for n in match.groups()]
+	if major >= 10:
+		return major * 10000 + minor
+	else:
+		return major * 10000 + minor * 100 + patch
+
+# Tokens
+#
+# The values of words are lower-cased, and the values of quoted identifiers
+# and strings are unquoted.  Comments and whitespace are skipped.
+
+token_pattern = re.compile(r"""
+	  (?P<space>   \s+ | --[^\n]* | /\*.*?\*/ )
+	| (?P<estring> [Ee]'(?:[^'\\]|''|\\.)*' )
+	| (?P<string>  '(?:[^']|'')*' )
+	| (?P<dollar>  \$(?:[A-Za-z_\x80-\xff][\w\x80-\xff]*)?\$ )
+	| (?P<ident>   "(?:[^"]|"")*" )
+	| (?P<word>    [A-Za-z_\x80-\xff][\w$\x80-\xff]* )
+	| (?P<number>  \d+(?:\.\d*)?(?:[Ee][-+]?\d+)? | \.\d+ )
+	| (?P<param>   \$\d+ )
+	| (?P<punct>   :: | [(),;\[\].] )
+	| (?P<op>      [-+*/<>=~!@\#%^&|`?:]+ )
+""", re.S | re.X)
+
+class Token(object):
+	def __init__(self, kind, value, start, end):
+		self.kind = kind
+		self.value = value
+		self.start = start
+		self.end = end
+
+def tokenize(text):
+	pos = 0
+
+	while pos < len(text):
+		match = token_pattern.match(text, pos)
+		if match is None:
+			raise DumpError("Unexpected character at offset %d" % pos)
+
+		kind = match.lastgroup
+		start, pos = match.span()
+		value = match.group()
+
+		if kind == "space":
+			continue
+		elif kind == "dollar":
+			close = text.find(value, pos)
+			if close < 0:
+				raise DumpError("Unterminated dollar quote at offset %d" % start)
+			kind, value, pos = "string", text[pos:close], close + len(value)
+		elif kind == "estring":
+			kind, value = "string", value[2:-1].replace("''", "'").decode("string_escape")
+		elif kind == "string":
+			value = value[1:-1].replace("''", "'")
+		elif kind == "ident":
+			value = data.intern_value(value[1:-1].replace('""', '"'))
+		elif kind == "word":
+			value = data.intern_value(value.lower())
+
+		yield Token(kind, value, start, pos)
+
+def split_statements(text):
+	tokens = []
+	depth = 0
+
+	for token in tokenize(text):
+		if token.kind == "punct":
+			if token.value == "(":
+				depth += 1
+			elif token.value == ")":
+				depth -= 1
+			elif token.value == ";" and depth == 0:
+				if tokens:
+					yield Statement(text, tokens)
+				tokens = []
+				continue
+		tokens.append(token)
+
+	if tokens:
+		yield Statement(text, tokens)
+
+def matches(token, value):
+	return token is not None and token.kind in ("word", "op", "punct") and token.value == value
+
+def is_punct(token, value):
+	return token is not None and token.kind == "punct" and token.value == value
+
+def is_name(token):
+	return token is not None and token.kind in ("word", "ident")
+
+# A statement, or a part of one, which is parsed from left to right
+
+class Statement(object):
+	def __init__(self, text, tokens):
+		self.text = text
+		self.tokens = tokens
+		self.pos = 0
+
+	def error(self, message):
+		return DumpError("%s in: %s" % (message, self.source()[:80]))
+
+	def at_end(self):
+		return self.pos >= len(self.tokens)
+
+	def peek(self, offset=0):
+		i = self.pos + offset
+		if i < len(self.tokens):
+			return self.tokens[i]
+		return None
+
+	def next(self):
+		token = self.peek()
+		if token is None:
+			raise self.error("Unexpected end of statement")
+		self.pos += 1
+		return token
+
+	def at(self, *values):
+		for i, value in enumerate(values):
+			if not matches(self.peek(i), value):
+				return False
+		return True
+
+	def accept(self, *values):
+		if self.at(*values):
+			self.pos += len(values)
+			return True
+		return False
+
+	def expect(self, *values):
+		if not self.accept(*values):
+			raise self.error("%s expected" % " ".join(values).upper())
+
+	def identifier(self):
+		token = self.next()
+		if not is_name(token) and token.kind != "string":
+			raise self.error("Name expected")
+		return token.value
+
+	# Returns the parts of a possibly qualified name
+	def name(self):
+		parts = [self.identifier()]
+		while is_punct(self.peek(), "."):
+			self.pos += 1
+			parts.append(self.identifier())
+		return parts
+
+	def operator_name(self):
+		parts = []
+		while is_name(self.peek()) and is_punct(self.peek(1), "."):
+			parts.append(self.next().value)
+			self.pos += 1
+		token = self.next()
+		if token.kind != "op":
+			raise self.error("Operator expected")
+		parts.append(token.value)
+		return parts
+
+	def number(self):
+		sign = 1
+		if matches(self.peek(), "-"):
+			self.pos += 1
+			sign = -1
+		token = self.next()
+		if token.kind != "number":
+			raise self.error("Number expected")
+		return sign * int(token.value)
+
+	# Consumes the tokens up to one of the stop sequences outside of
+	# parentheses
+	def until(self, *stops):
+		start = self.pos
+		depth = 0
+
+		while self.pos < len(self.tokens):
+			token = self.tokens[self.pos]
+			if token.kind == "punct" and token.value in ("(", "["):
+				depth += 1
+			elif token.kind == "punct" and token.value in (")", "]"):
+				depth -= 1
+			elif depth == 0 and [stop for stop in stops if self.at(*stop)]:
+				break
+			self.pos += 1
+
+		return Statement(self.text, self.tokens[start:self.pos])
+
+	def rest(self):
+		return self.until()
+
+	def skip_to_group(self):
+		while not is_punct(self.peek(), "("):
+			self.next()
+
+	# Consumes a parenthesized list and returns its items
+	def group(self):
+		if not is_punct(self.peek(), "("):
+			raise self.error("( expected")
+
+		start = self.pos + 1
+		depth = 0
+
+		while True:
+			token = self.next()
+			if token.kind == "punct" and token.value in ("(", "["):
+				depth += 1
+			elif token.kind == "punct" and token.value in (")", "]"):
+				depth -= 1
+				if depth == 0:
+					break
+
+		return Statement(self.text, self.tokens[start:self.pos - 1]).split()
+
+	def split(self):
+		items = []
+		while not self.at_end():
+			items.append(self.until((",",)))
+			self.pos += 1
+		return items
+
+	def source(self):
+		if self.tokens:
+			return self.text[self.tokens[0].start:self.tokens[-1].end]
+		else:
+			return ""
+
+	def names(self):
+		return set([token.value for token in self.tokens if is_name(token)])
+
+# The type names which pg_dump writes in SQL syntax
+
+type_aliases = {
+	"bigint":                      "int8",
+	"bit varying":                 "varbit",
+	"boolean":                     "bool",
+	"char":                        "bpchar",
+	"character":                   "bpchar",
+	"character varying":           "varchar",
+	"dec":                         "numeric",
+	"decimal":                     "numeric",
+	"double precision":            "float8",
+	"float":                       "float8",
+	"int":                         "int4",
+	"integer":                     "int4",
+	"national character":          "bpchar",
+	"national character varying":  "varchar",
+	"real":                        "float4",
+	"smallint":                    "int2",
+	"time with time zone":         "timetz",
+	"time without time zone":      "time",
+	"timestamp with time zone":    "timestamptz",
+	"timestamp without time zone": "timestamp",
+}
+
+# Words which start type names of more than one word; function arguments
+# which start with one have no name
+multiword_types = set(["bit", "char", "character", "double", "interval", "national", "time",
+                       "timestamp"])
+
+argument_modes = ["in", "out", "inout", "variadic"]
+
+column_options = [("collate",), ("default",), ("not", "null"), ("null",), ("constraint",),
+                  ("generated",), ("check",), ("primary",), ("unique",), ("references",)]
+
+function_options = [("language",), ("as",), ("immutable",), ("stable",), ("volatile",),
+                    ("strict",), ("called",), ("security",), ("external",), ("cost",),
+                    ("rows",), ("set",), ("window",), ("leakproof",), ("not",), ("parallel",),
+                    ("support",), ("transform",), ("begin",), ("return",)]
+
+table_constraint_types = {
+	"check":   data.CheckColumnConstraint,
+	"primary": data.PrimaryKey,
+	"unique":  data.UniqueColumnConstraint,
+}
+
+# Languages which aren't procedural, and so aren't listed in the database
+builtin_languages = ["c", "internal", "sql"]
+
+sequence_limits = {
+	"int2": (-32768, 32767),
+	"int4": (-2147483648, 2147483647),
+	"int8": (-9223372036854775808, 9223372036854775807),
+}
+
+class Loader(object):
+	def __init__(self, db, ignored, server_version):
+		self.db = db
+		self.ignored = ignored
+		self.server_version = server_version
+		self.search_path = ["public"]
+		self.namespaces = {}
+		self.languages = {}
+		self.types = {}
+		self.relations = {}
+		self.sequences = {}
+		self.functions = {}
+		self.operators = {}
+		self.opclasses = {}
+
+		for name in builtin_languages:
+			self.languages[name] = data.Language(name, None)
+		self.get_language("plpgsql")
+
+		self.create_namespace("public", None)
+
+	def has_version(self, version):
+		return self.server_version is None or self.server_version >= version
+
+	def is_interesting(self, ns):
+		return not ns.is_internal() and ns.name not in self.ignored
+
+	# Returns True if the statement defined or changed an object
+
+	def execute(self, stmt):
+		if stmt.accept("create"):
+			stmt.accept("or", "replace")
+			for words, handler in create_handlers:
+				if stmt.accept(*words):
+					return handler(self, stmt) is not False
+		elif stmt.accept("alter"):
+			for words, handler in alter_handlers:
+				if stmt.accept(*words):
+					return handler(self, stmt) is not False
+		elif stmt.accept("set", "search_path"):
+			stmt.next()
+			self.search_path = [name for name in [item.identifier() for item in stmt.rest().split()]
+			                    if name]
+		elif stmt.accept("select", "pg_catalog", ".", "set_config"):
+			items = stmt.group()
+			if items and items[0].identifier() == "search_path":
+				self.search_path = [name.strip() for name in items[1].identifier().split(",")
+				                    if name.strip()]
+		return False
+
+	# Names
+
+	def get_target_namespace(self):
+		for name in self.search_path:
+			if name != "pg_catalog":
+				return name
+		return "public"
+
+	def resolve(self, objects, parts):
+		if len(parts) > 1:
+			return parts[-2], parts[-1]
+		for ns_name in self.search_path:
+			if (ns_name, parts[0]) in objects:
+				return ns_name, parts[0]
+		return self.get_target_namespace(), parts[0]
+
+	def get_namespace(self, name):
+		ns = self.namespaces.get(name)
+		if ns is None:
+			ns = data.Namespace(name, None)
+			self.namespaces[name] = ns
+		return ns
+
+	def create_namespace(self, name, owner):
+		ns = self.get_namespace(name)
+		ns.owner = owner
+		if self.is_interesting(ns) and not [n for n in self.db.namespaces if n is ns]:
+			self.db.namespaces.append(ns)
+		return ns
+
+	def get_language(self, name):
+		language = self.languages.get(name)
+		if language is None:
+			language = data.Language(name, None)
+			self.languages[name] = language
+			self.db.languages.append(language)
+		return language
+
+	def find_relation(self, parts, objects=None):
+		if objects is None:
+			objects = self.relations
+		relation = objects.get(self.resolve(objects, parts))
+		if relation is None:
+			raise DumpError("Unknown relation %s" % ".".join(parts))
+		return relation
+
+	def find_column(self, relation, name):
+		for column in relation.columns.itervalues():
+			if column.name == name:
+				return column
+		raise DumpError("Unknown column %s of %s" % (name, relation.name))
+
+	def get_columns(self, relation, items):
+		return [self.find_column(relation, item.identifier()) for item in items]
+
+	def find_function(self, parts, argtypes):
+		ns_name, name = self.resolve(self.functions, parts)
+		for function in self.functions.get((ns_name, name), []):
+			if map(data.flatten, function.argtypes) == map(data.flatten, argtypes):
+				return function
+
+		# Functions which weren't dumped are created as they are referred to
+		function = data.Function(self.get_namespace(ns_name), name, None, None, None,
+		                         argtypes, None, None)
+		self.functions.setdefault((ns_name, name), []).append(function)
+		return function
+
+	# Types
+
+	def get_type(self, ns_name, name):
+		key = ns_name, name
+		type = self.types.get(key)
+		if type is None:
+			type = data.Type(self.get_namespace(ns_name), name, None, False, None)
+			self.types[key] = type
+		return type
+
+	# Parses a type name as pg_dump writes it: qualified or in SQL syntax,
+	# with modifiers and array bounds
+	def parse_type(self, stmt):
+		parts = [[]]
+		array = False
+		depth = 0
+
+		for token in stmt.tokens:
+			if token.kind == "punct" and token.value in ("(", "["):
+				array = array or token.value == "["
+				depth += 1
+			elif token.kind == "punct" and token.value in (")", "]"):
+				depth -= 1
+			elif depth:
+				continue
+			elif is_punct(token, "."):
+				parts.append([])
+			elif matches(token, "array"):
+				array = True
+			else:
+				parts[-1].append(token)
+
+		tokens = parts[-1]
+		if not tokens:
+			raise stmt.error("Type expected")
+
+		if len(tokens) == 1 and tokens[0].kind == "ident":
+			name = tokens[0].value
+		else:
+			name = " ".join([token.value for token in tokens])
+			if name.startswith("interval"):
+				name = "interval"
+			if len(parts) == 1 or parts[0][0].value == "pg_catalog":
+				name = type_aliases.get(name, name)
+
+		if len(parts) > 1:
+			ns_name = parts[-2][0].value
+		elif name in type_aliases.values() or name == "interval":
+			ns_name = "pg_catalog"
+		else:
+			ns_name = "pg_catalog"
+			search_path = self.search_path
+			if "pg_catalog" not in search_path:
+				search_path = ["pg_catalog"] + search_path
+			for sp_name in search_path:
+				if (sp_name, name) in self.types:
+					ns_name = sp_name
+					break
+
+		if array:
+			name = "_" + name
+		return self.get_type(ns_name, name)
+
+	# The server creates an array type for each type.  Array types are
+	# listed unless their element types are composite.
+	def define_type(self, classtype, key, listed, owner=None, notnull=False, default=None,
+	                array_listed=True):
+		ns = self.get_namespace(key[0])
+		type = self.types.get(key)
+		if type is None or type.__class__ is not classtype:
+			type = classtype(ns, key[1], owner, notnull, default)
+			self.types[key] = type
+		if listed:
+			ns.types.append(type)
+
+		array = self.get_type(key[0], "_" + key[1])
+		array.owner = owner
+		if array_listed:
+			ns.types.append(array)
+		return type
+
+	def define_rowtype(self, relation):
+		key = relation.namespace.name, relation.name
+		self.define_type(data.Type, key, False, relation.owner, array_listed=False)
+
+	def set_type_owner(self, type, owner):
+		type.owner = owner
+		array = self.types.get((type.namespace.name, "_" + type.name))
+		if array is not None:
+			array.owner = owner
+
+	def parse_argument(self, item):
+		if item.peek(0) is not None and item.peek(0).value in argument_modes and \
+		   item.peek(0).kind == "word" and item.peek(1) is not None:
+			if item.next().value == "out":
+				return None
+
+		tokens = item.until(("default",), ("=",)).tokens
+		if len(tokens) > 1 and is_name(tokens[0]) and not [value for value in (".", "(", "[")
+		                                                  if is_punct(tokens[1], value)]:
+			if tokens[0].kind == "ident" or tokens[0].value not in multiword_types:
+				tokens = tokens[1:]
+
+		return self.parse_type(Statement(item.text, tokens))
+
+	# Relations
+
+	def create_relation(self, classtype, listname, parts):
+		key = self.resolve(self.relations, parts)
+		ns = self.get_namespace(key[0])
+		relation = classtype(ns, key[1], None)
+		getattr(ns, listname).append(relation)
+		self.relations[key] = relation
+		self.define_rowtype(relation)
+		return relation
+
+	def set_relation_owner(self, relation, owner):
+		relation.owner = owner
+		self.set_type_owner(self.get_type(relation.namespace.name, relation.name), owner)
+		for obj in relation.xrefs:
+			if isinstance(obj, data.Index) and obj.table is relation:
+				obj.owner = owner
+
+	def add_index(self, table, name, columns):
+		ns = table.namespace
+		index = data.Index(ns, name, table.owner)
+		for num, column in enumerate(columns):
+			if column is not None:
+				index.columns[num + 1] = data.Column(column.name, column.type, False, None)
+		index.init_table(table)
+		ns.indexes.append(index)
+		self.relations[(ns.name, name)] = index
+		return index
+
+	def parse_column(self, item):
+		name = item.identifier()
+		type = self.parse_type(item.until(*column_options))
+		notnull = False
+		default = None
+
+		while not item.at_end():
+			if item.accept("not", "null"):
+				notnull = True
+			elif item.accept("default"):
+				default = item.until(*column_options).source() or None
+			elif item.accept("generated", "always", "as") and is_punct(item.peek(), "("):
+				default = item.until(("stored",)).source()[1:-1]
+			else:
+				item.next()
+
+		return data.Column(name, type, notnull, default)
+
+	def set_columns(self, relation, columns):
+		for num, column in enumerate(columns):
+			relation.columns[num + 1] = column
+
+	def add_table_constraint(self, table, name, stmt):
+		kind = stmt.peek()
+		definition = Statement(stmt.text, stmt.tokens[stmt.pos:]).source()
+
+		if stmt.accept("check"):
+			names = stmt.rest().names()
+			columns = [c for n, c in sorted(table.columns.iteritems()) if c.name in names]
+			cons = data.CheckColumnConstraint(name, definition, columns)
+		elif stmt.accept("primary", "key") or stmt.accept("unique"):
+			columns = self.get_columns(table, stmt.group())
+			included = []
+			if stmt.accept("include"):
+				included = self.get_columns(table, stmt.group())
+			cons = table_constraint_types[kind.value](name, definition, columns)
+			self.add_index(table, name, columns + included)
+		elif stmt.accept("foreign", "key"):
+			columns = self.get_columns(table, stmt.group())
+			stmt.expect("references")
+			f_table = self.find_relation(stmt.name())
+			if is_punct(stmt.peek(), "("):
+				f_columns = self.get_columns(f_table, stmt.group())
+			else:
+				f_columns = [c for cons in f_table.constraints if isinstance(cons, data.PrimaryKey)
+				             for c in cons.columns]
+			cons = data.ForeignKey(name, definition, columns, f_table, f_columns)
+		elif stmt.accept("exclude"):
+			# TODO: exclusion constraints (only their indexes are loaded)
+			stmt.skip_to_group()
+			items = stmt.group()
+			self.add_index(table, name, [self.find_column(table, item.identifier())
+			                             for item in items])
+			return
+		else:
+			raise stmt.error("Unknown constraint")
+
+		table.constraints.append(cons)
+
+	# Statements
+
+	def create_schema(self, stmt):
+		stmt.accept("if", "not", "exists")
+		name = stmt.identifier()
+		owner = None
+		if stmt.accept("authorization"):
+			owner = stmt.identifier()
+		self.create_namespace(name, owner)
+
+	def create_language(self, stmt):
+		self.get_language(stmt.identifier())
+
+	def create_type(self, stmt):
+		key = self.resolve(self.types, stmt.name())
+
+		if stmt.at_end():
+			# Shell type
+			self.get_type(*key)
+		elif stmt.accept("as", "enum"):
+			self.define_type(data.Type, key, True)
+		elif stmt.accept("as", "range"):
+			self.define_type(data.Type, key, False)
+			if self.has_version(140000):
+				name = key[1]
+				for item in stmt.group():
+					if item.accept("multirange_type_name"):
+						item.next()
+						name = item.rest().tokens[-1].value
+				if name == key[1]:
+					if "range" in name:
+						name = name.replace("range", "multirange", 1)
+					else:
+						name += "_multirange"
+				self.define_type(data.Type, (key[0], name), False)
+		elif stmt.accept("as"):
+			ns = self.get_namespace(key[0])
+			relation = data.Composite(ns, key[1], None)
+			ns.composites.append(relation)
+			self.relations[key] = relation
+			self.define_rowtype(relation)
+			self.set_columns(relation, [self.parse_column(item) for item in stmt.group()])
+		else:
+			self.define_type(data.Type, key, True)
+
+	def create_domain(self, stmt):
+		key = self.resolve(self.types, stmt.name())
+		stmt.accept("as")
+		basetype = self.parse_type(stmt.until(("collate",), ("default",), ("not", "null"),
+		                                      ("null",), ("constraint",), ("check",)))
+		notnull = False
+		default = None
+		constraints = []
+
+		while not stmt.at_end():
+			if stmt.accept("not", "null"):
+				notnull = True
+			elif stmt.accept("default"):
+				default = stmt.until(("not", "null"), ("null",), ("constraint",), ("check",)).source()
+			elif stmt.accept("constraint"):
+				name = stmt.identifier()
+				if stmt.at("check"):
+					definition = stmt.until(("constraint",)).source()
+					constraints.append(data.CheckConstraint(name, definition))
+				elif stmt.accept("not", "null"):
+					notnull = True
+			else:
+				stmt.next()
+
+		# Domains have array types since 11
+		domain = self.define_type(data.Domain, key, True, None, notnull, default,
+		                          self.has_version(110000))
+		domain.init_base(basetype)
+		domain.constraints.extend(constraints)
+
+	def create_function(self, stmt):
+		key = self.resolve(self.functions, stmt.name())
+		argtypes = [type for type in [self.parse_argument(item) for item in stmt.group()] if type]
+		rettype = None
+		language = None
+		sources = [""]
+
+		while not stmt.at_end():
+			if stmt.accept("returns"):
+				if stmt.accept("table"):
+					stmt.group()
+					rettype = self.get_type("pg_catalog", "record")
+				else:
+					stmt.accept("setof")
+					rettype = self.parse_type(stmt.until(*function_options))
+			elif stmt.accept("language"):
+				language = self.get_language(stmt.identifier())
+			elif stmt.accept("as"):
+				sources = [stmt.next().value]
+				while stmt.accept(","):
+					sources.append(stmt.next().value)
+			elif stmt.at("begin") or stmt.at("return"):
+				break
+			else:
+				stmt.next()
+
+		if len(sources) > 1:
+			src2, src1 = sources
+		else:
+			src1, src2 = data.trim_function(language.name, sources[0]), None
+
+		ns = self.get_namespace(key[0])
+		function = data.Function(ns, key[1], None, language, rettype, argtypes, src1, src2)
+		ns.functions.append(function)
+		self.functions.setdefault(key, []).append(function)
+
+	def create_table(self, stmt):
+		stmt.accept("if", "not", "exists")
+		table = self.create_relation(data.Table, "tables", stmt.name())
+		inherited = []
+		columns = []
+		constraints = []
+
+		if stmt.accept("partition", "of"):
+			inherited.append(self.find_relation(stmt.name()))
+
+		if is_punct(stmt.peek(), "("):
+			for item in stmt.group():
+				if item.accept("constraint"):
+					constraints.append((item.identifier(), item))
+				elif item.at("check") or item.at("primary") or item.at("unique") or \
+				     item.at("foreign") or item.at("exclude"):
+					constraints.append((None, item))
+				elif not item.at("like"):
+					columns.append(self.parse_column(item))
+
+		if stmt.accept("inherits"):
+			inherited.extend([self.find_relation(item.name()) for item in stmt.group()])
+
+		# Inherited columns come first, and are dumped only if they have
+		# local properties
+		if inherited:
+			merged = []
+			local = dict((column.name, column) for column in columns)
+			for parent in inherited:
+				for num, column in sorted(parent.columns.iteritems()):
+					if column.name not in [c.name for c in merged]:
+						column = local.pop(column.name, None) or \
+							data.Column(column.name, column.type, column.notnull, column.default)
+						merged.append(column)
+			columns = merged + [column for column in columns if column.name in local]
+
+		self.set_columns(table, columns)
+
+		for name, item in constraints:
+			self.add_table_constraint(table, name, item)
+
+	def create_view(self, stmt):
+		self.create_relation(data.View, "views", stmt.name())
+
+	def create_sequence(self, stmt):
+		stmt.accept("if", "not", "exists")
+		key = self.resolve(self.sequences, stmt.name())
+		self.add_sequence(key, None, stmt)
+
+	# Identity sequences have the type of their column unless the dump says
+	# otherwise
+
+	def add_sequence(self, key, owner, stmt, type_name="int8"):
+		increment = 1
+		minimum = None
+		maximum = None
+		limits = sequence_limits.get(type_name, sequence_limits["int8"])
+
+		while not stmt.at_end():
+			if stmt.accept("as"):
+				limits = sequence_limits.get(self.parse_type(Statement(stmt.text, [stmt.next()])).name,
+				                             limits)
+			elif stmt.accept("increment"):
+				stmt.accept("by")
+				increment = stmt.number()
+			elif stmt.accept("minvalue"):
+				minimum = stmt.number()
+			elif stmt.accept("maxvalue"):
+				maximum = stmt.number()
+			elif stmt.accept("sequence", "name"):
+				key = self.resolve(self.sequences, stmt.name())
+			elif stmt.accept("no"):
+				stmt.next()
+			else:
+				stmt.next()
+
+		if minimum is None:
+			minimum = increment > 0 and 1 or limits[0]
+		if maximum is None:
+			maximum = increment > 0 and limits[1] or -1
+
+		ns = self.get_namespace(key[0])
+		sequence = data.Sequence(ns, key[1], owner)
+		if self.is_interesting(ns):
+			sequence.init_values(increment, minimum, maximum)
+		ns.sequences.append(sequence)
+		self.sequences[key] = sequence
+
+	def create_index(self, stmt):
+		stmt.accept("concurrently")
+		stmt.accept("if", "not", "exists")
+		name = stmt.identifier()
+		stmt.expect("on")
+		stmt.accept("only")
+		table = self.find_relation(stmt.name())
+		stmt.skip_to_group()
+
+		columns = []
+		for item in stmt.group():
+			if is_name(item.peek()) and not is_punct(item.peek(1), "("):
+				columns.append(self.find_column(table, item.identifier()))
+			else:
+				columns.append(None)
+		if stmt.accept("include"):
+			columns.extend(self.get_columns(table, stmt.group()))
+
+		self.add_index(table, name, columns)
+
+	def create_trigger(self, stmt):
+		description = stmt.source()
+		name = stmt.identifier()
+		stmt.until(("on",))
+		stmt.expect("on")
+		table = self.find_relation(stmt.name())
+		stmt.until(("execute",))
+		stmt.expect("execute")
+		stmt.next()
+		function = self.find_function(stmt.name(), [])
+		table.triggers.append(data.Trigger(name, function, description, table))
+
+	def create_rule(self, stmt):
+		definition = stmt.source() + ";"
+		name = stmt.identifier()
+		stmt.until(("to",))
+		stmt.expect("to")
+		relation = self.find_relation(stmt.name())
+		relation.rules.append(data.Rule(name, definition))
+
+	def create_operator(self, stmt):
+		key = self.resolve({}, stmt.operator_name())
+		args = {}
+		for item in stmt.group():
+			option = item.identifier()
+			if option in ("leftarg", "rightarg"):
+				item.next()
+				args[option] = self.parse_type(item.rest())
+
+		ns = self.get_namespace(key[0])
+		operator = data.Operator(ns, key[1], None)
+		ns.operators.append(operator)
+		self.operators[key + (data.flatten(args.get("leftarg")),
+		                      data.flatten(args.get("rightarg")))] = operator
+
+	def create_opclass(self, stmt):
+		key = self.resolve({}, stmt.name())
+		default = stmt.accept("default")
+		stmt.expect("for", "type")
+		intype = self.parse_type(stmt.until(("using",)))
+		stmt.expect("using")
+		method = stmt.identifier()
+		keytype = None
+
+		stmt.until(("as",))
+		stmt.expect("as")
+		for item in stmt.rest().split():
+			if item.accept("storage"):
+				keytype = self.parse_type(item.rest())
+
+		ns = self.get_namespace(key[0])
+		opclass = data.OperatorClass(ns, method, key[1], None, intype, default, keytype)
+		ns.opclasses.append(opclass)
+		self.opclasses[key + (method,)] = opclass
+
+	def alter_table(self, stmt):
+		stmt.accept("if", "exists")
+		stmt.accept("only")
+		parts = stmt.name()
+
+		if self.resolve(self.sequences, parts) in self.sequences:
+			return self.set_owner(stmt, self.find_relation(parts, self.sequences))
+
+		table = self.find_relation(parts)
+
+		if stmt.accept("add", "constraint"):
+			name = stmt.identifier()
+			self.add_table_constraint(table, name, stmt)
+		elif stmt.accept("alter", "column") or stmt.accept("alter"):
+			column = self.find_column(table, stmt.identifier())
+			if stmt.accept("set", "default"):
+				column.default = stmt.rest().source()
+			elif stmt.accept("set", "not", "null"):
+				column.notnull = True
+			elif stmt.accept("add", "generated"):
+				stmt.skip_to_group()
+				items = stmt.group()
+				options = items and items[0] or Statement(stmt.text, [])
+				key = self.resolve(self.sequences, [table.namespace.name, "%s_%s_seq" %
+				                                    (table.name, column.name)])
+				self.add_sequence(key, table.owner, options, column.type.name)
+			else:
+				return False
+		else:
+			return self.set_owner(stmt, table)
+
+	def alter_view(self, stmt):
+		return self.set_owner(stmt, self.find_relation(stmt.name()))
+
+	def alter_sequence(self, stmt):
+		return self.set_owner(stmt, self.find_relation(stmt.name(), self.sequences))
+
+	def alter_schema(self, stmt):
+		ns = self.get_namespace(stmt.identifier())
+		return self.set_owner(stmt, ns)
+
+	def alter_language(self, stmt):
+		return self.set_owner(stmt, self.get_language(stmt.identifier()))
+
+	def alter_type(self, stmt):
+		key = self.resolve(self.types, stmt.name())
+		type = self.types.get(key)
+		if type is None:
+			return False
+
+		if stmt.accept("add", "constraint"):
+			name = stmt.identifier()
+			type.constraints.append(data.CheckConstraint(name, stmt.rest().source()))
+		elif isinstance(self.relations.get(key), data.Composite):
+			return self.set_owner(stmt, self.relations[key])
+		else:
+			return self.set_owner(stmt, type)
+
+	def alter_function(self, stmt):
+		parts = stmt.name()
+		argtypes = [type for type in [self.parse_argument(item) for item in stmt.group()] if type]
+		return self.set_owner(stmt, self.find_function(parts, argtypes))
+
+	def alter_operator(self, stmt):
+		key = self.resolve({}, stmt.operator_name())
+		args = [not item.at("none") and data.flatten(self.parse_type(item)) or None
+		        for item in stmt.group()]
+		return self.set_owner(stmt, self.operators.get(key + tuple(args)))
+
+	def alter_opclass(self, stmt):
+		key = self.resolve({}, stmt.name())
+		stmt.expect("using")
+		return self.set_owner(stmt, self.opclasses.get(key + (stmt.identifier(),)))
+
+	def set_owner(self, stmt, obj):
+		if obj is None or not stmt.accept("owner", "to"):
+			return False
+
+		owner = stmt.identifier()
+		if isinstance(obj, data.Relation):
+			self.set_relation_owner(obj, owner)
+		elif isinstance(obj, data.Type):
+			self.set_type_owner(obj, owner)
+		else:
+			obj.owner = owner
+
+def skip_statement(loader, stmt):
+	return False
+
+# The longer word sequences come first
+
+create_handlers = [
+	(("schema",),                           Loader.create_schema),
+	(("trusted", "procedural", "language"), Loader.create_language),
+	(("trusted", "language"),               Loader.create_language),
+	(("procedural", "language"),            Loader.create_language),
+	(("language",),                         Loader.create_language),
+	(("type",),                             Loader.create_type),
+	(("domain",),                           Loader.create_domain),
+	(("function",),                         Loader.create_function),
+	(("table",),                            Loader.create_table),
+	(("unlogged", "table"),                 Loader.create_table),
+	(("foreign", "table"),                  Loader.create_table),
+	(("sequence",),                         Loader.create_sequence),
+	(("view",),                             Loader.create_view),
+	(("materialized", "view"),              Loader.create_view),
+	(("unique", "index"),                   Loader.create_index),
+	(("index",),                            Loader.create_index),
+	(("constraint", "trigger"),             skip_statement),
+	(("trigger",),                          Loader.create_trigger),
+	(("rule",),                             Loader.create_rule),
+	(("operator", "class"),                 Loader.create_opclass),
+	(("operator", "family"),                skip_statement),
+	(("operator",),                         Loader.create_operator),
+]
+
+alter_handlers = [
+	(("table",),                            Loader.alter_table),
+	(("foreign", "table"),                  Loader.alter_table),
+	(("view",),                             Loader.alter_view),
+	(("materialized", "view"),              Loader.alter_view),
+	(("sequence",),                         Loader.alter_sequence),
+	(("schema",),                           Loader.alter_schema),
+	(("procedural", "language"),            Loader.alter_language),
+	(("language",),                         Loader.alter_language),
+	(("type",),                             Loader.alter_type),
+	(("domain",),                           Loader.alter_type),
+	(("function",),                         Loader.alter_function),
+	(("operator", "class"),                 Loader.alter_opclass),
+	(("operator", "family"),                skip_statement),
+	(("operator",),                         Loader.alter_operator),
+]
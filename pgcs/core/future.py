@@ -1,3 +1,4 @@
+import Queue
 import sys
 import threading
 import traceback
@@ -7,22 +8,201 @@ class FutureError(Exception):
 		Exception.__init__(self)
 		self.exception = exception
 
+class Cancelled(Exception):
+	pass
+
+_current = threading.local()
+
 class Future(object):
 	def __init__(self, call, *args):
+		self._init(call, args)
+		self._thread.start()
+
+	def _init(self, call, args):
 		self._thread = threading.Thread(target=self._run, args=(call, args))
 		self._thread.daemon = True
-		self._thread.start()
+		self._done = threading.Event()
+		self._lock = threading.Lock()
+		self._callbacks = []
+		self._cancellers = []
 
 	def _run(self, call, args):
+		_current.future = self
 		try:
-			self._result = call(*args)
-			self._error = None
+			result = call(*args)
 		except:
-			exctype, self._error, trace = sys.exc_info()
-			traceback.print_exception(exctype, self._error, trace)
+			exctype, error, trace = sys.exc_info()
+			self._release()
+			if self._finish(None, error):
+				traceback.print_exception(exctype, error, trace)
+		else:
+			self._release()
+			self._finish(result, None)
+
+	# Called when the call returns, before the result is made available
+	def _release(self):
+		pass
+
+	def _finish(self, result, error):
+		with self._lock:
+			if self._done.is_set():
+				return False
+			self._result = result
+			self._error = error
+			self._done.set()
+			callbacks = self._callbacks
+
+		for callback in callbacks:
+			callback(self)
+		return True
+
+	# The future is done when this returns, but the call may still be running
+	# until the cancel callbacks it has registered take effect
+
+	def cancel(self):
+		if self._finish(None, Cancelled()):
+			with self._lock:
+				cancellers = list(self._cancellers)
+
+			thread = threading.Thread(target=self._cancel, args=(cancellers,))
+			thread.daemon = True
+			thread.start()
+
+	def _cancel(self, cancellers):
+		for canceller in cancellers:
+			try:
+				canceller()
+			except Exception:
+				pass
+
+	def done(self):
+		return self._done.is_set()
+
+	def failed(self):
+		return self.done() and self._error is not None and not self.cancelled()
+
+	def cancelled(self):
+		return self.done() and isinstance(self._error, Cancelled)
+
+	def add_done_callback(self, callback):
+		with self._lock:
+			if not self._done.is_set():
+				self._callbacks.append(callback)
+				return
+
+		callback(self)
 
 	def get(self):
-		self._thread.join()
+		self._done.wait()
 		if self._error is not None:
 			raise FutureError(self._error)
 		return self._result
+
+# Registers a call which interrupts the future running in the current thread
+# when it is cancelled
+
+def on_cancel(canceller):
+	future = getattr(_current, "future", None)
+	if future is not None:
+		with future._lock:
+			future._cancellers.append(canceller)
+		if future.cancelled():
+			future._cancel([canceller])
+
+# Waits until all futures are done.  In fail_fast mode the first failure
+# cancels the others.  Returns the first future which failed, if any.
+
+def wait(futures, fail_fast=False):
+	done = Queue.Queue()
+	for future in futures:
+		future.add_done_callback(done.put)
+
+	failed = None
+
+	for i in xrange(len(futures)):
+		future = done.get()
+		if future.failed() and failed is None:
+			failed = future
+			if fail_fast:
+				for other in futures:
+					other.cancel()
+				break
+
+	return failed
+
+# Runs at most workers tasks at a time, and at most key_limit tasks with the
+# same key.  A task occupies weight slots of both limits; one which doesn't
+# fit under a limit at all is run alone.  Queued tasks are started in order
+# as running ones finish.  Tasks which run for longer than timeout seconds
+# are cancelled.
+
+class Pool(object):
+	def __init__(self, workers=None, key_limit=None, timeout=None):
+		self.workers = workers
+		self.key_limit = key_limit
+		self.timeout = timeout
+		self._lock = threading.Lock()
+		self._queue = []
+		self._running = 0
+		self._keys = {}
+
+	def submit(self, key, weight, call, *args):
+		task = Task(self, key, weight, call, args)
+		with self._lock:
+			self._queue.append(task)
+			self._dispatch()
+		return task
+
+	def _fits(self, task):
+		if self.workers is not None and self._running:
+			if self._running + task.weight > self.workers:
+				return False
+
+		running = self._keys.get(task.key, 0)
+		if self.key_limit is not None and running:
+			if running + task.weight > self.key_limit:
+				return False
+
+		return True
+
+	def _dispatch(self):
+		for task in list(self._queue):
+			if task.done():
+				self._queue.remove(task)
+			elif self._fits(task):
+				self._queue.remove(task)
+				self._running += task.weight
+				self._keys[task.key] = self._keys.get(task.key, 0) + task.weight
+				task._thread.start()
+
+	# Slots are held until the call returns, since the connections it uses
+	# stay open until then
+
+	def _finish(self, task):
+		with self._lock:
+			self._running -= task.weight
+			self._keys[task.key] -= task.weight
+			self._dispatch()
+
+class Task(Future):
+	def __init__(self, pool, key, weight, call, args):
+		self._init(call, args)
+		self.pool = pool
+		self.key = key
+		self.weight = weight
+
+	def _run(self, call, args):
+		self._timer = None
+		if self.pool.timeout is not None:
+			self._timer = threading.Timer(self.pool.timeout, self.cancel)
+			self._timer.daemon = True
+			self._timer.start()
+
+		Future._run(self, call, args)
+
+	# The slots are released before the waiters are woken up, so that the
+	# thread doesn't outlive the program
+	def _release(self):
+		if self._timer is not None:
+			self._timer.cancel()
+		self.pool._finish(self)
@@ -1,31 +1,670 @@
+import Queue
 import contextlib
 import functools
+import hashlib
+import os
 
 import psycopg2
 import psycopg2.extensions
 
+from . import cache
 from . import data
+from . import dump
 from . import future
+from . import stats
 
-def load_databases(sources, ignored=[]):
-	load = functools.partial(load_database, ignored=set(ignored))
-	futures = [future.Future(load, s) for s in sources]
-	return [f.get() for f in futures]
+# Table content probing strategies:
+#   "probe" -- one SELECT per table
+#   "batch" -- one SELECT per probe_batch_size tables
+#   "stats" -- no SELECT from the tables; the planner statistics tell which
+#              tables have rows, but not which are empty, so the content of
+#              the others is left unknown
+content_modes = ["probe", "batch", "stats"]
 
-def load_database(source, ignored):
-	db = data.Database(source)
+probe_batch_size = 1000
 
+# Options which change the loaded object graph, as opposed to how it is
+# loaded
+snapshot_options = ["interesting_only", "digests", "skipped"]
+
+# Scheduling options:
+#   workers     -- number of databases loaded at a time
+#   host_limit  -- number of connections opened to a server at a time
+#   timeout     -- seconds after which a load is cancelled
+#   fail_fast   -- cancel the other loads when one fails
+#   skip_failed -- leave out the databases which failed to load, instead of
+#                  raising an error
+
+schedule_options = ["workers", "host_limit", "timeout", "fail_fast", "skip_failed"]
+
+def load_databases(sources, ignored=[], cache_dir=None, skip_identical=False, **options):
+	if cache_dir:
+		snapshots = cache.Cache(cache_dir)
+	else:
+		snapshots = None
+
+	# Dumps have no server to compute the digests
+	scheduling = pop_options(options, schedule_options)
+	if has_dumps(sources):
+		options["digests"] = False
+	elif skip_identical and len(sources) > 1:
+		options["skipped"] = find_identical_namespaces(sources, ignored, scheduling)
+
+	load = functools.partial(load_database, ignored=set(ignored), snapshots=snapshots, **options)
+	try:
+		return schedule(load, sources, sources, options.get("connections", 1), **scheduling)
+	finally:
+		data.clear_keys()
+
+# Deferred texts never equal the plain texts of a dump, so the definitions
+# of a dump can't be compared with digests
+
+def has_dumps(sources):
+	return bool([s for s in sources if dump.is_dump(s)])
+
+# Sources which name pg_dump files or directories are loaded from the dumps
+
+def load_database(source, ignored, snapshots=None, **options):
+	if dump.is_dump(source):
+		return dump.load_dump(source, ignored, options.get("stats_callback"))
+
+	with connect(source) as cursor:
+		if snapshots is None:
+			db = data.Database(source)
+			populate_database(db, cursor, ignored, **options)
+		else:
+			db = load_snapshot(source, cursor, ignored, snapshots, **options)
+
+	return db
+
+# Brings databases loaded with the incremental option up to date.  The
+# returned database is either the patched original or a new one.
+
+def reload_databases(databases, ignored=[], **options):
+	scheduling = pop_options(options, schedule_options)
+	sources = [db.source for db in databases]
+	if has_dumps(sources):
+		options["digests"] = False
+	reload = functools.partial(reload_database, ignored=set(ignored), **options)
+	try:
+		return schedule(reload, databases, sources, options.get("connections", 1), **scheduling)
+	finally:
+		data.clear_keys()
+
+def reload_database(db, ignored, **options):
+	if dump.is_dump(db.source):
+		return dump.load_dump(db.source, ignored, options.get("stats_callback"))
+
+	with connect(db.source) as cursor:
+		return update_database(db, cursor, ignored, **options)
+
+def pop_options(options, names):
+	return dict((name, options.pop(name)) for name in names if name in options)
+
+def schedule(call, items, sources, connections, workers=None, host_limit=None, timeout=None,
+             fail_fast=False, skip_failed=False):
+	pool = future.Pool(workers, host_limit, timeout)
+	weight = max(connections, 1)
+	futures = [pool.submit(get_host(s), weight, call, i) for i, s in zip(items, sources)]
+
+	failed = future.wait(futures, fail_fast)
+	if fail_fast and failed is not None:
+		failed.get()
+
+	results = []
+
+	for source, result in zip(sources, futures):
+		try:
+			results.append(result.get())
+		except future.FutureError, e:
+			if not skip_failed:
+				raise
+			if result.cancelled():
+				print "%s:" % source, "Load cancelled"
+			else:
+				print "%s:" % source, "Load failed:", e.exception
+
+	return results
+
+# Namespaces which have the same digest in all databases are loaded only as
+# placeholders.  The digests are computed in separate transactions, so a
+# namespace changed between them and the load is shown as equal.
+#
+# Returns a sorted tuple of (name, digest) pairs.
+
+def find_identical_namespaces(sources, ignored, scheduling):
+	results = schedule(load_namespace_digests, sources, sources, 1, **scheduling)
+	if len(results) < len(sources):
+		return ()
+
+	identical = []
+	for name, digest in sorted(results[0].iteritems()):
+		if name not in ignored and all(r.get(name) == digest for r in results[1:]):
+			identical.append((name, digest))
+	return tuple(identical)
+
+# The sequence parameters can't be digested before they are in pg_sequence,
+# so no namespace is skipped on older servers
+
+def load_namespace_digests(source):
+	parts = {}
+
+	with connect(source) as cursor:
+		cursor.execute("""SET search_path TO pg_catalog""")
+		server_version = cursor.connection.server_version
+		if server_version < 100000:
+			return {}
+
+		for name, sql in sorted(get_digest_queries(server_version).iteritems()):
+			cursor.execute(sql)
+			for ns_name, digest in cursor:
+				parts.setdefault(ns_name, []).append("%s:%s" % (name, digest))
+
+	return dict((name, hashlib.md5(" ".join(p)).hexdigest()) for name, p in parts.iteritems())
+
+def get_host(source):
+	if dump.is_dump(source):
+		return source
+
+	params = psycopg2.extensions.parse_dsn(source)
+	host = params.get("host") or params.get("hostaddr") or os.environ.get("PGHOST", "")
+	port = params.get("port") or os.environ.get("PGPORT", "5432")
+	return host, port
+
+@contextlib.contextmanager
+def connect(source):
 	with contextlib.closing(psycopg2.connect(source)) as conn:
+		future.on_cancel(functools.partial(cancel_connection, conn))
 		conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE)
 		with contextlib.closing(conn.cursor()) as cursor:
-			populate_database(db, cursor, ignored)
+			yield cursor
+
+# Closing the connection makes sure that the load doesn't go on after the
+# cancelled statement
+
+def cancel_connection(conn):
+	conn.cancel()
+	conn.close()
+
+def load_snapshot(source, cursor, ignored, snapshots, content="probe", incremental=False, **options):
+	variant = [(name, options.get(name)) for name in snapshot_options]
+	key = source, tuple(sorted(ignored)), tuple(variant)
+	fingerprint = cache.get_fingerprint(cursor)
+
+	stored = snapshots.load(key)
+	if stored is not None and stored[0] == fingerprint:
+		db = stored[1]
+		db.stats = stats.Stats(db.get_name(), options.get("stats_callback"))
+		cursor.execute("""SET search_path TO pg_catalog""")
+		reprobe_tables(db, cursor, content, db.stats, options.get("probe_timeout"))
+		data.freeze(db)
+	else:
+		if stored is not None and incremental:
+			db = update_database(stored[1], cursor, ignored, content=content, **options)
+		else:
+			db = data.Database(source)
+			populate_database(db, cursor, ignored, content=content, incremental=incremental,
+			                  **options)
+		snapshots.store(key, fingerprint, db)
 
 	return db
 
+# Tables may have gained rows without touching the catalog; tool.drop must
+# not see them as empty.
+
+def reprobe_tables(db, cursor, content, statistics, probe_timeout=None):
+	db_prefix = "%s:" % db.get_name()
+	tables = []
+	for ns in db.namespaces:
+		for table in ns.tables:
+			if table.has_content is not True:
+				# A failed probe must not leave the stored answer behind
+				table.init_content(data.unknown)
+				tables.append((quote_name(ns.name, table.name), table))
+	with statistics.measure("probes") as phase:
+		probe_tables(cursor, db_prefix, tables, content, probe_timeout)
+		phase.objects = len(tables)
+
 def is_interesting_namespace(ns, ignored):
 	return not ns.is_internal() and ns.name not in ignored
 
-def populate_database(db, cursor, ignored):
+class LazyDict(dict):
+	def __init__(self, load):
+		dict.__init__(self)
+		self.load = load
+
+	def __missing__(self, key):
+		return self.load(key)
+
+def get_conditions(ns):
+	if ns is None:
+		return dict.fromkeys([
+			"types",
+			"relations",
+			"sequences",
+			"constraints",
+			"functions",
+			"triggers",
+			"rules",
+			"operators",
+			"opclasses",
+		], "TRUE")
+
+	relations = """relnamespace IN %(ns)s
+	               OR pg_class.oid IN (SELECT confrelid
+	                                   FROM pg_constraint
+	                                   WHERE contype = 'f' AND connamespace IN %(ns)s)""" % {"ns": ns}
+
+	functions = """pronamespace IN %(ns)s
+	               OR pg_proc.oid IN (SELECT tgfoid
+	                                  FROM pg_trigger, pg_class
+	                                  WHERE tgrelid = pg_class.oid AND relnamespace IN %(ns)s)""" % {"ns": ns}
+
+	# Types which aren't found here are loaded one by one when referenced
+
+	types = """a.typnamespace IN %(ns)s
+	           OR a.oid IN (SELECT atttypid
+	                        FROM pg_attribute, pg_class
+	                        WHERE attrelid = pg_class.oid AND (%(relations)s))
+	           OR a.oid IN (SELECT prorettype
+	                        FROM pg_proc
+	                        WHERE %(functions)s)
+	           OR a.oid IN (SELECT proargtypes[generate_series(0, pronargs - 1)]
+	                        FROM pg_proc
+	                        WHERE %(functions)s)
+	           OR a.oid IN (SELECT typbasetype
+	                        FROM pg_type
+	                        WHERE typnamespace IN %(ns)s)
+	           OR a.oid IN (SELECT opcintype
+	                        FROM pg_opclass
+	                        WHERE opcnamespace IN %(ns)s)
+	           OR a.oid IN (SELECT opckeytype
+	                        FROM pg_opclass
+	                        WHERE opcnamespace IN %(ns)s)""" % {
+		"ns":        ns,
+		"relations": relations,
+		"functions": functions,
+	}
+
+	return {
+		"types":       types,
+		"relations":   relations,
+		"sequences":   "relnamespace IN %s" % ns,
+		"constraints": "connamespace IN %s" % ns,
+		"functions":   functions,
+		"triggers":    "tgrelid IN (SELECT oid FROM pg_class WHERE relnamespace IN %s)" % ns,
+		"rules":       "ev_class IN (SELECT oid FROM pg_class WHERE relnamespace IN %s)" % ns,
+		"operators":   "oprnamespace IN %s" % ns,
+		"opclasses":   "opcnamespace IN %s" % ns,
+	}
+
+# The rows fetched by a query are counted in the phase of the same name,
+# unless another phase is given
+
+query_phases = {
+	"sequence_values": "sequences",
+}
+
+# raw_columns maps query names to the index of a column which isn't interned
+
+class Executor(object):
+	def __init__(self, cursor, batch_size=None, statistics=None, raw_columns={}):
+		self.cursor = cursor
+		self.batch_size = batch_size
+		self.stats = statistics or stats.Stats(None)
+		self.raw_columns = raw_columns
+
+	# Returns lazy row iterators; they must be consumed one at a time
+	def fetch(self, queries, phase=None):
+		rows = {}
+		for name, sql in queries.iteritems():
+			rows[name] = self._iterate(name, sql, phase or query_phases.get(name, name))
+		return rows
+
+	# Phases are looked up when the rows are consumed, so that they are listed
+	# in loading order
+
+	def _iterate(self, name, sql, phase):
+		counter = self.stats.get(phase)
+		raw = self.raw_columns.get(name)
+		for row in iterate_rows(self.cursor, name, sql, self.batch_size, counter, raw):
+			yield row
+
+	def map(self, call, items):
+		call(self.cursor, items)
+
+	def close(self):
+		pass
+
+# Each query's rows are collected in full by the connection which runs it,
+# while the graph is built from the rows of another one.  A batch size
+# wouldn't limit the memory use, so the tools don't allow it here.
+
+class SnapshotExecutor(Executor):
+	def __init__(self, source, cursor, connections, batch_size=None, statistics=None,
+	             raw_columns={}):
+		Executor.__init__(self, cursor, batch_size, statistics, raw_columns)
+
+		cursor.execute("""SELECT pg_export_snapshot()""")
+		snapshot, = cursor.fetchone()
+
+		self.connections = []
+		self.cursors = Queue.Queue()
+		self.cursors.put(cursor)
+
+		try:
+			for i in xrange(connections - 1):
+				conn = psycopg2.connect(source)
+				self.connections.append(conn)
+				future.on_cancel(functools.partial(cancel_connection, conn))
+				conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE)
+				worker = conn.cursor()
+				worker.execute("""SET TRANSACTION SNAPSHOT %s""", (snapshot,))
+				worker.execute("""SET search_path TO pg_catalog""")
+				self.cursors.put(worker)
+		except:
+			self.close()
+			raise
+
+	def _call(self, call, *args):
+		cursor = self.cursors.get()
+		try:
+			return call(cursor, *args)
+		finally:
+			self.cursors.put(cursor)
+
+	def fetch(self, queries, phase=None):
+		rows = {}
+		for name, sql in queries.iteritems():
+			args = fetch_rows, name, sql, self.batch_size, self.raw_columns.get(name)
+			phase_name = phase or query_phases.get(name, name)
+			rows[name] = self._wait(future.Future(self._call, *args), phase_name)
+		return rows
+
+	# The counts of each query are merged by the thread which consumes its
+	# rows, so that the phases aren't updated concurrently
+
+	def _wait(self, result, phase_name):
+		rows, counter = result.get()
+		phase = self.stats.get(phase_name)
+		phase.query_time += counter.query_time
+		phase.rows += counter.rows
+		for row in rows:
+			yield row
+
+	def map(self, call, items):
+		count = len(self.connections) + 1
+		futures = [future.Future(self._call, call, items[i::count]) for i in xrange(count)]
+		for result in futures:
+			result.get()
+
+	def close(self):
+		for conn in self.connections:
+			conn.close()
+
+def fetch_rows(cursor, name, sql, batch_size, raw=None):
+	phase = stats.Phase(name)
+	return list(iterate_rows(cursor, name, sql, batch_size, phase, raw)), phase
+
+# With a batch size the rows are streamed through a server-side cursor, so
+# that only batch_size rows are buffered at a time
+
+def iterate_rows(cursor, name, sql, batch_size, phase, raw=None):
+	if batch_size:
+		with contextlib.closing(cursor.connection.cursor("pgcs_%s" % name)) as stream:
+			stats.timed(phase, stream.execute, sql)
+			while True:
+				rows = stats.timed(phase, stream.fetchmany, batch_size)
+				if not rows:
+					break
+				phase.rows += len(rows)
+				for row in rows:
+					yield data.intern_row(row, raw)
+	else:
+		stats.timed(phase, cursor.execute, sql)
+		phase.rows += max(cursor.rowcount, 0)
+		for row in cursor:
+			yield data.intern_row(row, raw)
+
+# The statistics of the load are kept in db.stats; stats_callback is called
+# with the database name and each phase when it's done
+
+def populate_database(db, cursor, ignored, content="probe", interesting_only=False, connections=1,
+                      batch_size=None, incremental=False, stats_callback=None, digests=False,
+                      skipped=(), probe_timeout=None):
+	statistics = db.stats = stats.Stats(db.get_name(), stats_callback)
+	definitions = digests and Definitions(db.source) or None
+	raw_columns = digests and digest_indexes or {}
+	cursor.execute("""SET search_path TO pg_catalog""")
+
+	# Snapshots can be shared between connections since 9.2
+	if connections > 1 and cursor.connection.server_version >= 90200:
+		executor = SnapshotExecutor(db.source, cursor, connections, batch_size, statistics,
+		                            raw_columns)
+	else:
+		executor = Executor(cursor, batch_size, statistics, raw_columns)
+
+	with contextlib.closing(executor):
+		catalog = build_database(db, cursor, executor, ignored, content, interesting_only,
+		                         definitions, skipped, probe_timeout)
+		if incremental:
+			server_version = cursor.connection.server_version
+			with statistics.measure("versions") as phase:
+				versions = fetch_versions(executor, catalog.conditions, server_version)
+				phase.objects = sum(len(v) for v in versions.itervalues())
+			catalog.init_versions(cache.get_fingerprint(cursor), versions)
+			db.catalog = catalog
+
+	with statistics.measure("freeze"):
+		data.freeze(db)
+
+# Function sources are compared as data.trim_function leaves them
+
+trimmed_source = """CASE WHEN prolang IN (SELECT oid FROM pg_language WHERE lanname = 'plpgsql')
+                         THEN array_to_string(array(SELECT btrim(line, E' \\t\\r\\f\\013')
+                                                    FROM regexp_split_to_table(prosrc, E'\\n') AS line
+                                                    WHERE btrim(line, E' \\t\\r\\f\\013') != ''), ' ')
+                         ELSE prosrc
+                    END"""
+
+type_query = """SELECT a.oid, a.typname, a.typnamespace, a.typowner, a.typtype,
+                       a.typnotnull, a.typdefault, b.typrelid, a.typbasetype
+                FROM pg_type AS a
+                LEFT OUTER JOIN pg_type AS b ON a.typelem = b.oid
+                WHERE a.typisdefined AND (%s)
+                ORDER BY a.typnamespace, a.typname"""
+
+# Constraint triggers are linked to pg_constraint since 9.0
+
+def get_trigger_condition(server_version):
+	if server_version >= 90000:
+		return "tgconstraint = 0"
+	else:
+		return "NOT tgisconstraint"
+
+# The digests of definition texts are prefixed with the oid of the row the
+# text can be fetched from
+
+def get_queries(conditions, server_version, digests=False):
+	def text(key, expression, digested=None):
+		if digests:
+			return "%s || ' ' || md5(%s)" % (key, digested or expression)
+		else:
+			return expression
+
+	queries = {
+		"types": type_query % conditions["types"],
+
+		"relations": """SELECT oid, relname, relowner, relnamespace, relkind
+		                FROM pg_class
+		                WHERE relkind != 'S' AND (%s)
+		                ORDER BY relnamespace, relkind, relname""" % conditions["relations"],
+
+		"indexes": """SELECT indexrelid, indrelid
+		              FROM pg_index""",
+
+		"attributes": """SELECT attrelid, attname, atttypid, attnum, attnotnull, %s
+		                 FROM pg_attribute
+		                 INNER JOIN pg_class ON attrelid = pg_class.oid
+		                 LEFT OUTER JOIN pg_attrdef ON attrelid = adrelid AND attnum = adnum
+		                 WHERE relkind != 'S' AND attnum > 0 AND NOT attisdropped AND (%s)
+		                 ORDER BY attrelid, attnum""" % (text("pg_attrdef.oid",
+		                                                      "pg_get_expr(adbin, attrelid)"),
+		                                                 conditions["relations"]),
+
+		"sequences": """SELECT oid, relname, relowner, relnamespace
+		                FROM pg_class
+		                WHERE relkind = 'S' AND (%s)
+		                ORDER BY relnamespace, relname""" % conditions["sequences"],
+
+		"constraints": """SELECT conname, contype, conrelid, contypid, confrelid, conkey, confkey,
+		                         %s
+		                  FROM pg_constraint
+		                  WHERE %s
+		                  ORDER BY conrelid, contype, conname""" % (text("oid", "pg_get_constraintdef(oid)"),
+		                                                            conditions["constraints"]),
+
+		"functions": """SELECT oid, proname, pronamespace, proowner, prolang, prorettype,
+		                       proargtypes, %s, probin
+		                FROM pg_proc
+		                WHERE %s
+		                ORDER BY pronamespace, proname""" % (text("oid", "prosrc", trimmed_source),
+		                                                     conditions["functions"]),
+
+		"triggers": """SELECT tgrelid, tgname, tgfoid, %s
+		               FROM pg_trigger
+		               WHERE %s AND (%s)
+		               ORDER BY tgrelid, tgname""" % (text("oid", "pg_get_triggerdef(oid)"),
+		                                              get_trigger_condition(server_version),
+		                                              conditions["triggers"]),
+
+		"rules": """SELECT rulename, ev_class, %s
+		            FROM pg_rewrite
+		            WHERE rulename != '_RETURN' AND (%s)
+		            ORDER BY ev_class, rulename""" % (text("oid", "pg_get_ruledef(oid)"),
+		                                              conditions["rules"]),
+
+		"operators": """SELECT oid, oprname, oprnamespace, oprowner
+		                FROM pg_operator
+		                WHERE %s
+		                ORDER BY oprnamespace, oprname""" % conditions["operators"],
+
+		"opclasses": """SELECT pg_opclass.oid, amname, opcname, opcnamespace, opcowner,
+		                       opcintype, opcdefault, opckeytype
+		                FROM pg_opclass, pg_am
+		                WHERE opcmethod = pg_am.oid AND (%s)
+		                ORDER BY opcnamespace, opcname, opcintype, amname""" % conditions["opclasses"],
+	}
+
+	# The sequence parameters moved into a catalog in 10.0; older servers
+	# need a query per sequence
+	if server_version >= 100000:
+		queries["sequence_values"] = """SELECT seqrelid, seqincrement, seqmin, seqmax
+		                                FROM pg_sequence"""
+
+	return queries
+
+# Each digest query returns the name and the digest of the items of each
+# non-internal namespace.  The items describe everything the objects are
+# compared by, with references to other objects by name, so that equal
+# digests mean equal namespaces.
+
+def get_digest_queries(server_version):
+	def query(item, tables, ns_column, condition="TRUE"):
+		return """SELECT nspname, md5(string_agg(item, E'\\n' ORDER BY item))
+		          FROM (SELECT nspname, (%s)::text AS item
+		                FROM pg_namespace, %s
+		                WHERE pg_namespace.oid = %s AND (%s)
+		                      AND nspname !~ '^pg_' AND nspname != 'information_schema') AS items
+		          GROUP BY nspname""" % (item, tables, ns_column, condition)
+
+	return {
+		"types": query("""ROW(typname, typtype, pg_get_userbyid(typowner), typnotnull, typdefault,
+		                      typbasetype::regtype)""",
+		               "pg_type", "typnamespace", "typisdefined"),
+
+		"relations": query("""ROW(relname, relkind, pg_get_userbyid(relowner))""",
+		                   "pg_class", "relnamespace"),
+
+		"attributes": query("""ROW(relname, attnum, attname, atttypid::regtype, attnotnull,
+		                           md5(pg_get_expr(adbin, adrelid)))""",
+		                    """pg_class
+		                       INNER JOIN pg_attribute ON attrelid = pg_class.oid
+		                       LEFT OUTER JOIN pg_attrdef ON attrelid = adrelid AND attnum = adnum""",
+		                    "relnamespace", "attnum > 0 AND NOT attisdropped"),
+
+		"indexes": query("""ROW(relname, indrelid::regclass)""",
+		                 "pg_class INNER JOIN pg_index ON indexrelid = pg_class.oid",
+		                 "relnamespace"),
+
+		"sequences": query("""ROW(relname, seqincrement, seqmin, seqmax)""",
+		                   "pg_class INNER JOIN pg_sequence ON seqrelid = pg_class.oid",
+		                   "relnamespace"),
+
+		"constraints": query("""ROW(conname, contype, conrelid::regclass, contypid::regtype,
+		                            md5(pg_get_constraintdef(pg_constraint.oid)))""",
+		                     "pg_constraint", "connamespace"),
+
+		"functions": query("""ROW(pg_proc.oid::regprocedure, pg_get_userbyid(proowner), lanname,
+		                          prorettype::regtype, md5(%s), md5(probin))""" % trimmed_source,
+		                   "pg_proc INNER JOIN pg_language ON prolang = pg_language.oid",
+		                   "pronamespace"),
+
+		"triggers": query("""ROW(relname, tgname, tgfoid::regprocedure,
+		                         md5(pg_get_triggerdef(pg_trigger.oid)))""",
+		                  "pg_class INNER JOIN pg_trigger ON tgrelid = pg_class.oid",
+		                  "relnamespace", get_trigger_condition(server_version)),
+
+		"rules": query("""ROW(relname, rulename, md5(pg_get_ruledef(pg_rewrite.oid)))""",
+		               "pg_class INNER JOIN pg_rewrite ON ev_class = pg_class.oid",
+		               "relnamespace", "rulename != '_RETURN'"),
+
+		"operators": query("""ROW(pg_operator.oid::regoperator, pg_get_userbyid(oprowner))""",
+		                   "pg_operator", "oprnamespace"),
+
+		"opclasses": query("""ROW(opcname, amname, pg_get_userbyid(opcowner), opcintype::regtype,
+		                          opcdefault, opckeytype::regtype)""",
+		                   "pg_opclass INNER JOIN pg_am ON opcmethod = pg_am.oid",
+		                   "opcnamespace"),
+	}
+
+type_types = {
+	"b": data.Type,
+	"c": data.Type, # composite
+	"d": data.Domain,
+	"e": data.Type, # enum
+	"m": data.Type, # multirange
+	"p": data.Type, # pseudo
+	"r": data.Type, # range
+}
+
+relation_types = {
+	"I": (data.Index, "indexes"), # partitioned
+	"c": (data.Composite, "composites"),
+	"f": (data.Table, "tables"), # foreign
+	"i": (data.Index, "indexes"),
+	"m": (data.View, "views"), # materialized
+	"p": (data.Table, "tables"), # partitioned
+	"r": (data.Table, "tables"),
+	"t": (data.Table, "tables"),
+	"v": (data.View, "views"),
+}
+
+relation_lists = dict(relation_types.values())
+
+table_constraint_types = {
+	"c": data.CheckColumnConstraint,
+	"u": data.UniqueColumnConstraint,
+	"p": data.PrimaryKey,
+}
+
+domain_constraint_types = {
+	"c": data.CheckConstraint,
+	"u": data.UniqueConstraint,
+}
+
+def build_database(db, cursor, executor, ignored, content, interesting_only, definitions=None,
+                   skipped=(), probe_timeout=None):
 	db_prefix = "%s:" % db.get_name()
 
 	roles = {}
@@ -34,274 +673,1102 @@ def populate_database(db, cursor, ignored):
 	types = {}
 	relations = {}
 	tables = []
-	sequences = []
+	sequences = {}
 	functions = {}
 	operators = {}
 	opclasses = {}
 
-	cursor.execute("""SET search_path TO pg_catalog""")
+	server_version = cursor.connection.server_version
+	statistics = executor.stats
+	digests = dict(skipped)
+
+	rows = executor.fetch({
+		"roles": """SELECT oid, rolname
+		            FROM pg_roles""",
+
+		"languages": """SELECT oid, lanname, lanowner, lanispl
+		                FROM pg_language
+		                ORDER BY lanname""",
+
+		"namespaces": """SELECT oid, nspname, nspowner
+		                 FROM pg_namespace
+		                 ORDER BY nspname""",
+	})
 
 	# Roles
 
-	cursor.execute("""SELECT oid, rolname
-	                  FROM pg_roles""")
-	for row in cursor:
-		oid, name = row
-		roles[oid] = name
+	with statistics.measure("roles") as phase:
+		for row in rows["roles"]:
+			oid, name = row
+			roles[oid] = name
+		phase.objects = len(roles)
 
 	# Languages
 
-	cursor.execute("""SELECT oid, lanname, lanowner, lanispl
-	                  FROM pg_language
-	                  ORDER BY lanname""")
-	for row in cursor:
-		oid, name, owner_oid, userdefined = row
-		language = data.Language(name, roles[owner_oid])
-		languages[oid] = language
-		if userdefined:
-			db.languages.append(language)
+	with statistics.measure("languages") as phase:
+		for row in rows["languages"]:
+			oid, name, owner_oid, userdefined = row
+			language = data.Language(name, roles[owner_oid])
+			languages[oid] = language
+			if userdefined:
+				db.languages.append(language)
+		phase.objects = len(languages)
 
 	# namespaces
 
-	cursor.execute("""SELECT oid, nspname, nspowner
-	                  FROM pg_namespace
-	                  ORDER BY nspname""")
-	for row in cursor:
-		oid, name, owner_oid = row
-		ns = data.Namespace(name, roles[owner_oid])
-		namespaces[oid] = ns
-		if is_interesting_namespace(ns, ignored):
-			db.namespaces.append(ns)
+	with statistics.measure("namespaces") as phase:
+		for row in rows["namespaces"]:
+			oid, name, owner_oid = row
+			ns = data.Namespace(name, roles[owner_oid])
+			namespaces[oid] = ns
+			if is_interesting_namespace(ns, ignored):
+				if name in digests:
+					ns = data.Namespace(name, roles[owner_oid])
+					ns.init_digest(digests[name])
+				db.namespaces.append(ns)
+		phase.objects = len(namespaces)
+
+	# Only objects in interesting namespaces, and the ones they refer to, are
+	# loaded in interesting_only mode.  The objects of skipped namespaces are
+	# loaded only as far as others refer to them, and they aren't placed in
+	# the placeholders.
+
+	restricted = interesting_only or digests
+
+	if restricted:
+		ns_oids = [oid for oid, ns in namespaces.iteritems()
+		           if is_interesting_namespace(ns, ignored) and ns.name not in digests]
+		conditions = get_conditions(format_oids(ns_oids))
+	else:
+		conditions = get_conditions(None)
+
+	rows = executor.fetch(get_queries(conditions, server_version, definitions is not None))
+	if definitions is not None:
+		definitions.defer_rows(rows)
 
 	# Types
 	# TODO: type properties
 
-	type_types = {
-		"b": data.Type,
-		"c": data.Type, # composite
-		"d": data.Domain,
-		"e": data.Type, # enum
-		"p": data.Type, # pseudo
-	}
+	# The time of the types loaded later is counted in the phase which
+	# referred to them
+
+	def load_type(oid):
+		phase = statistics.get("types")
+		with contextlib.closing(cursor.connection.cursor()) as type_cursor:
+			stats.timed(phase, type_cursor.execute, type_query % "a.oid = %s", (oid,))
+			row = type_cursor.fetchone()
+		if row is None:
+			raise KeyError(oid)
+		row = data.intern_row(row)
+		type = create_type(row, namespaces, roles, types)
+		base_oid = row[-1]
+		if base_oid:
+			type.init_base(types[base_oid])
+		phase.rows += 1
+		phase.objects += 1
+		return type
+
+	if restricted:
+		types = LazyDict(load_type)
+
+	domains = []
+
+	with statistics.measure("types") as phase:
+		for row in rows["types"]:
+			type = create_type(row, namespaces, roles, types)
+			base_oid = row[-1]
+			if base_oid:
+				domains.append((type, base_oid))
+			phase.objects += 1
 
-	cursor.execute("""SELECT a.oid, a.typname, a.typnamespace, a.typowner, a.typtype,
-	                         a.typnotnull, a.typdefault, b.typrelid
-	                  FROM pg_type AS a
-	                  LEFT OUTER JOIN pg_type AS b ON a.typelem = b.oid
-	                  WHERE a.typisdefined
-	                  ORDER BY a.typnamespace, a.typname""")
-	for row in cursor:
-		oid, name, ns_oid, owner_oid, kind, notnull, default, super_oid = row
-		ns = namespaces[ns_oid]
-		type = type_types[kind](ns, name, roles[owner_oid], notnull, default)
-		types[oid] = type
-		if kind in "bde" and not super_oid:
-			ns.types.append(type)
-
-	cursor.execute("""SELECT oid, typbasetype
-	                  FROM pg_type
-	                  WHERE typisdefined AND typbasetype != 0""")
-	for row in cursor:
-		oid, base_oid = row
-		types[oid].init_base(types[base_oid])
+		for type, base_oid in domains:
+			type.init_base(types[base_oid])
 
 	# Relations
 
-	relation_types = {
-		"c": (data.Composite, "composites"),
-		"i": (data.Index, "indexes"),
-		"r": (data.Table, "tables"),
-		"t": (data.Table, "tables"),
-		"v": (data.View, "views"),
+	with statistics.measure("relations") as phase:
+		for row in rows["relations"]:
+			oid, name, owner_oid, ns_oid, kind = row
+			relation = create_relation(row, namespaces, roles)
+			relations[oid] = relation
+			if kind in "rt" and is_interesting_namespace(relation.namespace, ignored) and \
+			   relation.namespace.name not in digests:
+				tables.append((quote_name(relation.namespace.name, name), relation))
+		phase.objects = len(relations)
+
+	with statistics.measure("indexes") as phase:
+		for row in rows["indexes"]:
+			index_oid, table_oid = row
+			index = relations.get(index_oid)
+			if index is not None:
+				table = relations[table_oid]
+				index.init_table(table)
+				phase.objects += 1
+
+	with statistics.measure("attributes") as phase:
+		for row in rows["attributes"]:
+			relation_oid, name, type_oid, num, notnull, default = row
+			column = data.Column(name, types[type_oid], notnull, default)
+			relations[relation_oid].columns[num] = column
+			phase.objects += 1
+
+	def probe(cursor, tables):
+		probe_tables(cursor, db_prefix, tables, content, probe_timeout)
+
+	with statistics.measure("probes") as phase:
+		executor.map(probe, tables)
+		phase.objects = len(tables)
+
+	# Sequences
+
+	with statistics.measure("sequences") as phase:
+		for row in rows["sequences"]:
+			sequences[row[0]] = create_sequence(row, namespaces, roles)
+
+		init_sequences(db_prefix, executor, rows, sequences, ignored)
+		phase.objects = len(sequences)
+
+	# Constraints
+
+	with statistics.measure("constraints") as phase:
+		for row in rows["constraints"]:
+			if add_constraint(row, relations, types):
+				phase.objects += 1
+
+	# Functions
+
+	with statistics.measure("functions") as phase:
+		for row in rows["functions"]:
+			functions[row[0]] = create_function(row, namespaces, roles, languages, types)
+		phase.objects = len(functions)
+
+	# Triggers
+
+	with statistics.measure("triggers") as phase:
+		for row in rows["triggers"]:
+			add_trigger(row, relations, functions)
+			phase.objects += 1
+
+	# Rules
+
+	with statistics.measure("rules") as phase:
+		for row in rows["rules"]:
+			add_rule(row, relations)
+			phase.objects += 1
+
+	# Operators
+	# TODO: operator properties
+	# TODO: operator class operators/functions
+
+	with statistics.measure("operators") as phase:
+		for row in rows["operators"]:
+			oid, name, ns_oid, owner_oid = row
+			ns = namespaces[ns_oid]
+			operator = data.Operator(ns, name, roles[owner_oid])
+			operators[oid] = operator
+			ns.operators.append(operator)
+		phase.objects = len(operators)
+
+	with statistics.measure("opclasses") as phase:
+		for row in rows["opclasses"]:
+			oid, method, name, ns_oid, owner_oid, intype_oid, default, keytype_oid = row
+			ns = namespaces[ns_oid]
+			owner = roles[owner_oid]
+			intype = types[intype_oid]
+			keytype = keytype_oid and types[keytype_oid] or None
+			opclass = data.OperatorClass(ns, method, name, owner, intype, default, keytype)
+			opclasses[oid] = opclass
+			ns.opclasses.append(opclass)
+		phase.objects = len(opclasses)
+
+	# TODO: casts
+
+	return Catalog(ignored, interesting_only, conditions, roles, languages, namespaces,
+	               dict(types), relations, functions, sequences, definitions, skipped)
+
+# The create functions reinitialize the old object in place if one is given,
+# so that the references to it stay valid.  The caller must have unlinked it
+# from its referees first.
+
+def create_type(row, namespaces, roles, types, type=None):
+	oid, name, ns_oid, owner_oid, kind, notnull, default, super_oid, base_oid = row
+	ns = namespaces[ns_oid]
+	values = ns, name, roles[owner_oid], notnull, default
+	if type is None:
+		type, old_ns = type_types[kind](*values), None
+	else:
+		old_ns = type.namespace
+		reinit(type, *values)
+	types[oid] = type
+	if kind in "bde" and not super_oid:
+		place_object(type, old_ns, "types")
+	return type
+
+def create_relation(row, namespaces, roles, relation=None):
+	oid, name, owner_oid, ns_oid, kind = row
+	ns = namespaces[ns_oid]
+	classtype, listname = relation_types[kind]
+	values = ns, name, roles[owner_oid]
+	if relation is None:
+		relation, old_ns = classtype(*values), None
+	else:
+		old_ns = relation.namespace
+		reinit(relation, *values)
+	place_object(relation, old_ns, listname)
+	return relation
+
+def create_sequence(row, namespaces, roles, sequence=None):
+	oid, name, owner_oid, ns_oid = row
+	ns = namespaces[ns_oid]
+	values = ns, name, roles[owner_oid]
+	if sequence is None:
+		sequence, old_ns = data.Sequence(*values), None
+	else:
+		old_ns = sequence.namespace
+		reinit(sequence, *values)
+	place_object(sequence, old_ns, "sequences")
+	return sequence
+
+def create_function(row, namespaces, roles, languages, types, function=None):
+	oid, name, ns_oid, owner_oid, lang_oid, rettype_oid, argtype_oids, src1, src2 = row
+	ns = namespaces[ns_oid]
+	owner = roles[owner_oid]
+	lang = languages[lang_oid]
+	rettype = types[rettype_oid]
+	argtypes = [types[int(oid)] for oid in argtype_oids.split()]
+	if not isinstance(src1, data.Deferred):
+		src1 = data.trim_function(lang.name, src1)
+	values = ns, name, owner, lang, rettype, argtypes, src1, src2
+	if function is None:
+		function, old_ns = data.Function(*values), None
+	else:
+		old_ns = function.namespace
+		reinit(function, *values)
+	place_object(function, old_ns, "functions")
+	return function
+
+def reinit(obj, *values):
+	xrefs = getattr(obj, "xrefs", None)
+	obj.__init__(*values)
+	if xrefs is not None:
+		obj.xrefs = xrefs
+
+def place_object(obj, old_ns, listname):
+	if obj.namespace is not old_ns:
+		if old_ns is not None:
+			remove_object(getattr(old_ns, listname), obj)
+		getattr(obj.namespace, listname).append(obj)
+
+def init_sequences(db_prefix, executor, rows, sequences, ignored):
+	sequences = dict((oid, sequence) for oid, sequence in sequences.iteritems()
+	                 if is_interesting_namespace(sequence.namespace, ignored))
+
+	if "sequence_values" in rows:
+		for row in rows["sequence_values"]:
+			oid, increment, minimum, maximum = row
+			if oid in sequences:
+				sequences[oid].init_values(increment, minimum, maximum)
+	else:
+		def probe(cursor, sequences):
+			probe_sequences(cursor, db_prefix, sequences)
+
+		executor.map(probe, [(quote_name(s.namespace.name, s.name), s)
+		                     for oid, s in sorted(sequences.iteritems())])
+
+def add_constraint(row, relations, types):
+	name, kind, table_oid, domain_oid, f_oid, col_nums, f_nums, definition = row
+	if kind not in "cfpu":
+		# TODO: exclusion constraints (constraint triggers are loaded as
+		#       triggers)
+		return
+	if table_oid:
+		table = relations[table_oid]
+		cols = [table.columns[n] for n in col_nums]
+		if kind == "f":
+			f_table = relations[f_oid]
+			f_cols = [f_table.columns[n] for n in f_nums]
+			cons = data.ForeignKey(name, definition, cols, f_table, f_cols)
+		else:
+			cons = table_constraint_types[kind](name, definition, cols)
+		table.constraints.append(cons)
+	else:
+		cons = domain_constraint_types[kind](name, definition)
+		types[domain_oid].constraints.append(cons)
+	return cons
+
+def add_trigger(row, relations, functions):
+	table_oid, name, function_oid, description = row
+	table = relations[table_oid]
+	trigger = data.Trigger(name, functions[function_oid], description, table)
+	table.triggers.append(trigger)
+
+def add_rule(row, relations):
+	name, table_oid, definition = row
+	rule = data.Rule(name, definition)
+	relations[table_oid].rules.append(rule)
+
+def format_oids(oids):
+	return "(%s)" % (", ".join([str(oid) for oid in oids]) or "NULL")
+
+# Definition texts
+#
+# With the digests option only the md5 digests of function sources, column
+# defaults and constraint, trigger and rule definitions are loaded.  The
+# texts are fetched over a new connection when they are needed, typically
+# only for the ones which differ between the databases.
+
+# Query name -> (column index, kind of definition)
+digest_columns = {
+	"attributes":  (5, "default"),
+	"constraints": (7, "constraint"),
+	"functions":   (7, "source"),
+	"triggers":    (3, "trigger"),
+	"rules":       (2, "rule"),
+}
+
+# The digests are unique, so they aren't interned
+digest_indexes = dict((name, index) for name, (index, kind) in digest_columns.iteritems())
+
+definition_queries = {
+	"default": """SELECT oid, pg_get_expr(adbin, adrelid)
+	              FROM pg_attrdef
+	              WHERE oid IN %s""",
+
+	"constraint": """SELECT oid, pg_get_constraintdef(oid)
+	                 FROM pg_constraint
+	                 WHERE oid IN %s""",
+
+	"source": """SELECT pg_proc.oid, prosrc, lanname
+	             FROM pg_proc, pg_language
+	             WHERE prolang = pg_language.oid AND pg_proc.oid IN %s""",
+
+	"trigger": """SELECT oid, pg_get_triggerdef(oid)
+	              FROM pg_trigger
+	              WHERE oid IN %s""",
+
+	"rule": """SELECT oid, pg_get_ruledef(oid)
+	           FROM pg_rewrite
+	           WHERE oid IN %s""",
+}
+
+class Definitions(object):
+	def __init__(self, source):
+		self.source = source
+		self.texts = {}
+
+	# Replaces the digest columns of the query results with deferred texts
+	def defer_rows(self, rows):
+		for name, (index, kind) in digest_columns.iteritems():
+			if name in rows:
+				rows[name] = self._defer(rows[name], index, kind)
+
+	def _defer(self, rows, index, kind):
+		for row in rows:
+			value = row[index]
+			if value is not None:
+				oid, digest = value.split(" ", 1)
+				value = data.Deferred(self, (kind, int(oid)), digest)
+			yield row[:index] + (value,) + row[index + 1:]
+
+	# The texts are kept with their digests, and a text which doesn't match
+	# the digest loaded with it has changed since the database was loaded
+	def get_text(self, value):
+		self.fetch([value])
+		if value.key not in self.texts:
+			raise Exception("Definition of %s %d no longer exists" % value.key)
+
+		digest, text = self.texts[value.key]
+		if digest != value.digest:
+			raise Exception("Definition of %s %d has changed" % value.key)
+		return text
+
+	def fetch(self, values):
+		oids = {}
+		for value in values:
+			digest, text = self.texts.get(value.key, (None, None))
+			if digest != value.digest:
+				kind, oid = value.key
+				oids.setdefault(kind, set()).add(oid)
+
+		if not oids:
+			return
+
+		with connect(self.source) as cursor:
+			cursor.execute("""SET search_path TO pg_catalog""")
+			for kind, kind_oids in sorted(oids.iteritems()):
+				cursor.execute(definition_queries[kind] % format_oids(sorted(kind_oids)))
+				for row in cursor:
+					oid, text = row[:2]
+					if kind == "source":
+						text = data.trim_function(row[2], text)
+					self.texts[kind, oid] = get_digest(text), data.intern_value(text)
+
+def get_digest(text):
+	if isinstance(text, unicode):
+		text = text.encode("utf-8")
+	return hashlib.md5(text).hexdigest()
+
+# Incremental reloading
+#
+# The oid maps built by the loader are kept with a database loaded with the
+# incremental option, along with the xmin of every catalog row it was built
+# from.  Rows which changed, appeared or disappeared since then are traced
+# to the relations, sequences and functions they belong to, and only those
+# are fetched again and patched into the object graph.
+
+class Catalog(object):
+	def __init__(self, ignored, interesting_only, conditions, roles, languages, namespaces, types,
+	             relations, functions, sequences, definitions=None, skipped=()):
+		self.ignored = set(ignored)
+		self.interesting_only = interesting_only
+		self.conditions = conditions
+		self.roles = roles
+		self.languages = languages
+		self.namespaces = namespaces
+		self.types = types
+		self.relations = relations
+		self.functions = functions
+		self.sequences = sequences
+		self.definitions = definitions
+		self.skipped = skipped
+		self.fingerprint = None
+		self.versions = None
+
+	def init_versions(self, fingerprint, versions):
+		self.fingerprint = fingerprint
+		self.versions = versions
+
+	def get_objects(self):
+		objects = []
+		for map in (self.languages, self.namespaces, self.types, self.relations, self.functions,
+		            self.sequences):
+			objects.extend(map.itervalues())
+		return objects
+
+# The version rows of each group are patched as this kind of object; rows
+# which don't belong to one (such as domain constraints and types other than
+# relation row types) require a full reload
+
+version_targets = {
+	"types":           "relations",
+	"relations":       "relations",
+	"attributes":      "relations",
+	"defaults":        "relations",
+	"indexes":         "relations",
+	"constraints":     "relations",
+	"triggers":        "relations",
+	"rules":           "relations",
+	"sequences":       "sequences",
+	"sequence_values": "sequences",
+	"functions":       "functions",
+}
+
+# Changes in other fingerprinted catalogs require a full reload
+
+patched_catalogs = set([
+	"pg_type",
+	"pg_class",
+	"pg_index",
+	"pg_attribute",
+	"pg_attrdef",
+	"pg_constraint",
+	"pg_proc",
+	"pg_trigger",
+	"pg_rewrite",
+	"pg_sequence",
+])
+
+class CatalogChanged(Exception):
+	pass
+
+# Each version query returns (key, owner oid, xmin) rows
+
+def get_version_queries(conditions, server_version):
+	queries = {
+		"types": """SELECT a.oid, coalesce(nullif(a.typrelid, 0), b.typrelid, 0), a.xmin
+		            FROM pg_type AS a
+		            LEFT OUTER JOIN pg_type AS b ON a.typelem = b.oid
+		            WHERE a.typisdefined AND (%s)""" % conditions["types"],
+
+		"relations": """SELECT oid, oid, xmin
+		                FROM pg_class
+		                WHERE relkind != 'S' AND (%s)""" % conditions["relations"],
+
+		"attributes": """SELECT attrelid || '.' || attnum, attrelid, pg_attribute.xmin
+		                 FROM pg_attribute
+		                 INNER JOIN pg_class ON attrelid = pg_class.oid
+		                 WHERE relkind != 'S' AND attnum > 0 AND (%s)""" % conditions["relations"],
+
+		"defaults": """SELECT pg_attrdef.oid, adrelid, pg_attrdef.xmin
+		               FROM pg_attrdef
+		               INNER JOIN pg_class ON adrelid = pg_class.oid
+		               WHERE %s""" % conditions["relations"],
+
+		"indexes": """SELECT indexrelid, indexrelid, pg_index.xmin
+		              FROM pg_index
+		              INNER JOIN pg_class ON indexrelid = pg_class.oid
+		              WHERE %s""" % conditions["relations"],
+
+		"sequences": """SELECT oid, oid, xmin
+		                FROM pg_class
+		                WHERE relkind = 'S' AND (%s)""" % conditions["sequences"],
+
+		"constraints": """SELECT oid, conrelid, xmin
+		                  FROM pg_constraint
+		                  WHERE %s""" % conditions["constraints"],
+
+		"functions": """SELECT oid, oid, xmin
+		                FROM pg_proc
+		                WHERE %s""" % conditions["functions"],
+
+		"triggers": """SELECT oid, tgrelid, xmin
+		               FROM pg_trigger
+		               WHERE %s AND (%s)""" % (get_trigger_condition(server_version),
+		                                       conditions["triggers"]),
+
+		"rules": """SELECT oid, ev_class, xmin
+		            FROM pg_rewrite
+		            WHERE %s""" % conditions["rules"],
 	}
 
-	cursor.execute("""SELECT oid, relname, relowner, relnamespace, relkind
-	                  FROM pg_class
-	                  WHERE relkind != 'S'
-	                  ORDER BY relnamespace, relkind, relname""")
-	for row in cursor:
-		oid, name, owner_oid, ns_oid, kind = row
-		ns = namespaces[ns_oid]
-		classtype, listname = relation_types[kind]
-		relation = classtype(ns, name, roles[owner_oid])
-		relations[oid] = relation
-		getattr(ns, listname).append(relation)
-		if kind in "rt" and is_interesting_namespace(ns, ignored):
-			full_name = '"%s"."%s"' % (ns.name, name)
-			tables.append((full_name, relation))
-
-	cursor.execute("""SELECT indexrelid, indrelid
-	                  FROM pg_index""")
-	for row in cursor:
+	if server_version >= 100000:
+		queries["sequence_values"] = """SELECT seqrelid, seqrelid, xmin
+		                                FROM pg_sequence"""
+
+	return queries
+
+def fetch_versions(executor, conditions, server_version):
+	versions = {}
+	queries = get_version_queries(conditions, server_version)
+	for name, rows in executor.fetch(queries, "versions").iteritems():
+		versions[name] = dict((key, (owner, xmin)) for key, owner, xmin in rows)
+	return versions
+
+def update_database(db, cursor, ignored, content="probe", interesting_only=False, connections=1,
+                    batch_size=None, stats_callback=None, digests=False, skipped=(),
+                    probe_timeout=None):
+	cursor.execute("""SET search_path TO pg_catalog""")
+	fingerprint = cache.get_fingerprint(cursor)
+
+	catalog = getattr(db, "catalog", None)
+	if catalog is not None and catalog.ignored == set(ignored) and \
+	   catalog.interesting_only == interesting_only and \
+	   (catalog.definitions is not None) == digests and catalog.skipped == skipped:
+		statistics = stats.Stats(db.get_name(), stats_callback)
+		try:
+			if catalog.fingerprint != fingerprint:
+				executor = Executor(cursor, batch_size, statistics, digests and digest_indexes or {})
+				data.thaw(db)
+				try:
+					patch_database(db, catalog, executor, fingerprint, ignored)
+				finally:
+					data.freeze(db)
+		except CatalogChanged:
+			pass
+		else:
+			db.stats = statistics
+			reprobe_tables(db, cursor, content, statistics, probe_timeout)
+			return db
+
+	db = data.Database(db.source)
+	populate_database(db, cursor, ignored, content=content, interesting_only=interesting_only,
+	                  connections=connections, batch_size=batch_size, incremental=True,
+	                  stats_callback=stats_callback, digests=digests, skipped=skipped,
+	                  probe_timeout=probe_timeout)
+	return db
+
+def patch_database(db, catalog, executor, fingerprint, ignored):
+	db_prefix = "%s:" % db.get_name()
+
+	for name, value in catalog.fingerprint.iteritems():
+		if name not in patched_catalogs and fingerprint.get(name) != value:
+			raise CatalogChanged()
+
+	server_version = executor.cursor.connection.server_version
+	with executor.stats.measure("versions") as phase:
+		versions = fetch_versions(executor, catalog.conditions, server_version)
+		phase.objects = sum(len(v) for v in versions.itervalues())
+
+	dirty = {
+		"relations": set(),
+		"sequences": set(),
+		"functions": set(),
+	}
+
+	for name, target in version_targets.iteritems():
+		old = catalog.versions.get(name, {})
+		new = versions.get(name, {})
+		for key in set(old) | set(new):
+			if old.get(key) != new.get(key):
+				owner, xmin = new.get(key) or old.get(key)
+				if not owner:
+					raise CatalogChanged()
+				dirty[target].add(owner)
+
+	with executor.stats.measure("versions"):
+		mark_dependents(executor, catalog, dirty)
+
+	dropped_types = [oid for oid, (owner, xmin) in catalog.versions["types"].iteritems()
+	                 if owner in dirty["relations"] and oid not in versions["types"]]
+
+	relation_oids = format_oids(sorted(dirty["relations"]))
+	sequence_oids = format_oids(sorted(dirty["sequences"]))
+	function_oids = format_oids(sorted(dirty["functions"]))
+
+	conditions = catalog.conditions
+	queries = get_queries({
+		"types":       "(%s) AND (a.typrelid IN %s OR b.typrelid IN %s)"
+		               % (conditions["types"], relation_oids, relation_oids),
+		"relations":   "(%s) AND pg_class.oid IN %s" % (conditions["relations"], relation_oids),
+		"sequences":   "(%s) AND pg_class.oid IN %s" % (conditions["sequences"], sequence_oids),
+		"constraints": "(%s) AND conrelid IN %s" % (conditions["constraints"], relation_oids),
+		"functions":   "(%s) AND pg_proc.oid IN %s" % (conditions["functions"], function_oids),
+		"triggers":    "(%s) AND tgrelid IN %s" % (conditions["triggers"], relation_oids),
+		"rules":       "(%s) AND ev_class IN %s" % (conditions["rules"], relation_oids),
+		"operators":   "FALSE",
+		"opclasses":   "FALSE",
+	}, server_version, catalog.definitions is not None)
+
+	del queries["operators"]
+	del queries["opclasses"]
+
+	queries["indexes"] = """SELECT indexrelid, indrelid
+	                        FROM pg_index
+	                        WHERE indexrelid IN %s""" % relation_oids
+
+	if "sequence_values" in queries:
+		queries["sequence_values"] = """SELECT seqrelid, seqincrement, seqmin, seqmax
+		                                FROM pg_sequence
+		                                WHERE seqrelid IN %s""" % sequence_oids
+
+	with executor.stats.measure("patch") as phase:
+		results = executor.fetch(queries, "patch")
+		if catalog.definitions is not None:
+			catalog.definitions.defer_rows(results)
+
+		rows = {}
+		for name, result in results.iteritems():
+			rows[name] = list(result)
+
+		# Nothing has been modified so far, so a full reload is still possible
+
+		check_patch(catalog, dirty, dropped_types, rows)
+		apply_patch(db_prefix, catalog, executor, dirty, dropped_types, rows, ignored)
+		phase.objects = sum(len(oids) for oids in dirty.itervalues())
+
+	# Changed definitions keep the oids of their rows
+	if catalog.definitions is not None:
+		catalog.definitions.texts.clear()
+
+	catalog.init_versions(fingerprint, versions)
+
+# Column defaults and constraint, trigger and rule definitions are rendered
+# with the current names of the objects they mention, but renaming those
+# doesn't touch their rows.  The relations which depend on a renamed or moved
+# relation, column, sequence or function are fetched again.
+
+def mark_dependents(executor, catalog, dirty):
+	relation_oids = format_oids(sorted(dirty["relations"]))
+	class_oids = format_oids(sorted(dirty["relations"] | dirty["sequences"]))
+	function_oids = format_oids(sorted(dirty["functions"]))
+
+	rows = executor.fetch({
+		"class_names": """SELECT oid, relname, relnamespace
+		                  FROM pg_class
+		                  WHERE oid IN %s""" % class_oids,
+
+		"column_names": """SELECT attrelid, attnum, attname
+		                   FROM pg_attribute
+		                   WHERE attnum > 0 AND NOT attisdropped AND attrelid IN %s""" % relation_oids,
+
+		"function_names": """SELECT oid, proname, pronamespace
+		                     FROM pg_proc
+		                     WHERE oid IN %s""" % function_oids,
+	}, "versions")
+
+	def is_renamed(obj, name, ns_oid):
+		return obj is not None and (obj.name != name or
+		                            obj.namespace is not catalog.namespaces.get(ns_oid))
+
+	renamed = set()
+
+	for oid, name, ns_oid in rows["class_names"]:
+		obj = catalog.relations.get(oid) or catalog.sequences.get(oid)
+		if is_renamed(obj, name, ns_oid):
+			renamed.add(oid)
+
+	for relation_oid, num, name in rows["column_names"]:
+		relation = catalog.relations.get(relation_oid)
+		column = relation and relation.columns.get(num)
+		if column is not None and column.name != name:
+			renamed.add(relation_oid)
+
+	for oid, name, ns_oid in rows["function_names"]:
+		if is_renamed(catalog.functions.get(oid), name, ns_oid):
+			renamed.add(oid)
+
+	if not renamed:
+		return
+
+	rows = executor.fetch({
+		"dependents": """SELECT DISTINCT CASE classid
+		                     WHEN 'pg_attrdef'::regclass
+		                         THEN (SELECT adrelid FROM pg_attrdef WHERE oid = objid)
+		                     WHEN 'pg_constraint'::regclass
+		                         THEN (SELECT conrelid FROM pg_constraint WHERE oid = objid)
+		                     WHEN 'pg_trigger'::regclass
+		                         THEN (SELECT tgrelid FROM pg_trigger WHERE oid = objid)
+		                     WHEN 'pg_rewrite'::regclass
+		                         THEN (SELECT ev_class FROM pg_rewrite WHERE oid = objid)
+		                 END
+		                 FROM pg_depend
+		                 WHERE refclassid IN ('pg_class'::regclass, 'pg_proc'::regclass) AND
+		                       refobjid IN %s AND
+		                       classid IN ('pg_attrdef'::regclass, 'pg_constraint'::regclass,
+		                                   'pg_trigger'::regclass, 'pg_rewrite'::regclass)"""
+		              % format_oids(sorted(renamed)),
+	}, "versions")
+
+	for owner, in rows["dependents"]:
+		# Domain constraints aren't patched
+		if not owner:
+			raise CatalogChanged()
+		dirty["relations"].add(owner)
+
+def apply_patch(db_prefix, catalog, executor, dirty, dropped_types, rows, ignored):
+	namespaces = catalog.namespaces
+	roles = catalog.roles
+	types = catalog.types
+	relations = catalog.relations
+	functions = catalog.functions
+	sequences = catalog.sequences
+
+	# Relation row types
+
+	for oid in dropped_types:
+		del types[oid]
+
+	for row in rows["types"]:
+		create_type(row, namespaces, roles, types, types.get(row[0]))
+
+	# Functions
+
+	function_rows = dict((row[0], row) for row in rows["functions"])
+
+	for oid in dirty["functions"]:
+		function = functions.pop(oid, None)
+		row = function_rows.get(oid)
+		if function is not None:
+			data.unxref(function, function.language)
+			data.unxref(function, function.rettype)
+			data.unxref(function, function.argtypes)
+			if row is None:
+				remove_object(function.namespace.functions, function)
+		if row is not None:
+			functions[oid] = create_function(row, namespaces, roles, catalog.languages, types,
+			                                 function)
+
+	# Relations
+
+	relation_rows = dict((row[0], row) for row in rows["relations"])
+	old_columns = {}
+
+	for oid in dirty["relations"]:
+		relation = relations.pop(oid, None)
+		row = relation_rows.get(oid)
+		if relation is not None:
+			unlink_relation(relation)
+			old_columns[oid] = relation.columns
+			if row is None:
+				remove_object(getattr(relation.namespace, relation_lists[type(relation)]), relation)
+		if row is not None:
+			relations[oid] = create_relation(row, namespaces, roles, relation)
+
+	for row in rows["indexes"]:
 		index_oid, table_oid = row
 		index = relations.get(index_oid)
 		if index is not None:
-			table = relations[table_oid]
-			index.init_table(table)
-
-	cursor.execute("""SELECT attrelid, attname, atttypid, attnum, attnotnull,
-	                         pg_get_expr(adbin, attrelid)
-	                  FROM pg_attribute
-	                  INNER JOIN pg_class ON attrelid = pg_class.oid
-	                  LEFT OUTER JOIN pg_attrdef ON attrelid = adrelid AND attnum = adnum
-	                  WHERE relkind != 'S' AND attnum > 0 AND NOT attisdropped
-	                  ORDER BY attrelid, attnum""")
-	for row in cursor:
+			index.init_table(relations[table_oid])
+
+	# Columns keep their identity, since constraints of other tables may
+	# refer to them
+
+	for row in rows["attributes"]:
 		relation_oid, name, type_oid, num, notnull, default = row
-		column = data.Column(name, types[type_oid], notnull, default)
+		values = name, types[type_oid], notnull, default
+		column = old_columns.get(relation_oid, {}).get(num)
+		if column is None:
+			column = data.Column(*values)
+		else:
+			reinit(column, *values)
 		relations[relation_oid].columns[num] = column
 
-	for full_name, table in tables:
-		cursor.execute("""SAVEPOINT table_savepoint""")
-		try:
-			cursor.execute("""SELECT 1 FROM %s LIMIT 1""" % full_name)
-		except:
-			cursor.execute("""ROLLBACK TO SAVEPOINT table_savepoint""")
-			print db_prefix, "Failed to access table", full_name
-		else:
-			table.init_content(cursor.fetchone() is not None)
-			cursor.execute("""RELEASE SAVEPOINT table_savepoint""")
+	for row in rows["constraints"]:
+		add_constraint(row, relations, types)
+
+	for row in rows["triggers"]:
+		add_trigger(row, relations, functions)
+
+	for row in rows["rules"]:
+		add_rule(row, relations)
 
 	# Sequences
 
-	cursor.execute("""SELECT relname, relowner, relnamespace
-	                  FROM pg_class
-	                  WHERE relkind = 'S'
-	                  ORDER BY relnamespace, relname""")
-	for row in cursor:
-		name, owner_oid, ns_oid = row
-		ns = namespaces[ns_oid]
-		sequence = data.Sequence(ns, name, roles[owner_oid])
-		ns.sequences.append(sequence)
-		if is_interesting_namespace(ns, ignored):
-			full_name = '"%s"."%s"' % (ns.name, name)
-			sequences.append((full_name, sequence))
+	sequence_rows = dict((row[0], row) for row in rows["sequences"])
+	changed = {}
 
-	for full_name, sequence in sequences:
-		cursor.execute("""SAVEPOINT sequence""")
-		try:
-			cursor.execute("""SELECT increment_by, min_value, max_value
-			                  FROM %s""" % full_name)
-		except:
-			cursor.execute("""ROLLBACK TO SAVEPOINT sequence""")
-			print db_prefix, "Failed to access sequence", full_name
-		else:
-			sequence.init_values(*cursor.fetchone())
-			cursor.execute("""RELEASE SAVEPOINT sequence""")
+	for oid in dirty["sequences"]:
+		sequence = sequences.pop(oid, None)
+		row = sequence_rows.get(oid)
+		if sequence is not None and row is None:
+			remove_object(sequence.namespace.sequences, sequence)
+		if row is not None:
+			sequences[oid] = changed[oid] = create_sequence(row, namespaces, roles, sequence)
 
-	# Constraints
+	init_sequences(db_prefix, executor, rows, changed, ignored)
 
-	table_constraint_types = {
-		"c": data.CheckColumnConstraint,
-		"u": data.UniqueColumnConstraint,
-		"p": data.PrimaryKey,
-	}
+	restore_xrefs(catalog)
 
-	domain_constraint_types = {
-		"c": data.CheckConstraint,
-		"u": data.UniqueConstraint,
-	}
+	for ns in namespaces.itervalues():
+		ns.invalidate()
+
+# Makes sure that everything the patched rows refer to will be found
+
+def check_patch(catalog, dirty, dropped_types, rows):
+	def check(condition):
+		if not condition:
+			raise CatalogChanged()
+
+	relation_rows = dict((row[0], row) for row in rows["relations"])
+
+	type_oids = set(catalog.types).difference(dropped_types)
+	type_oids.update(row[0] for row in rows["types"])
+	relation_oids = set(catalog.relations).difference(dirty["relations"])
+	relation_oids.update(relation_rows)
+	function_oids = set(catalog.functions).difference(dirty["functions"])
+	function_oids.update(row[0] for row in rows["functions"])
 
-	cursor.execute("""SELECT conname, contype, conrelid, contypid, confrelid, conkey, confkey,
-	                         pg_get_constraintdef(oid)
-	                  FROM pg_constraint
-	                  ORDER BY conrelid, contype, conname""")
-	for row in cursor:
-		name, kind, table_oid, domain_oid, f_oid, col_nums, f_nums, definition = row
-		if table_oid:
-			table = relations[table_oid]
-			cols = [table.columns[n] for n in col_nums]
+	for row in rows["types"]:
+		oid, name, ns_oid, owner_oid = row[:4]
+		check(ns_oid in catalog.namespaces and owner_oid in catalog.roles)
+
+	for oid, row in relation_rows.iteritems():
+		oid, name, owner_oid, ns_oid, kind = row
+		check(ns_oid in catalog.namespaces and owner_oid in catalog.roles)
+		check(kind in relation_types)
+		relation = catalog.relations.get(oid)
+		check(relation is None or type(relation) is relation_types[kind][0])
+
+	columns = {}
+
+	for row in rows["attributes"]:
+		relation_oid, name, type_oid, num = row[:4]
+		check(relation_oid in relation_rows and type_oid in type_oids)
+		columns.setdefault(relation_oid, set()).add(num)
+
+	def has_columns(relation_oid, nums):
+		if relation_oid in dirty["relations"]:
+			return set(nums).issubset(columns.get(relation_oid, ()))
+		else:
+			return set(nums).issubset(catalog.relations[relation_oid].columns)
+
+	for row in rows["indexes"]:
+		index_oid, table_oid = row
+		if index_oid in relation_rows:
+			check(table_oid in relation_oids)
+
+	for row in rows["constraints"]:
+		name, kind, table_oid, domain_oid, f_oid, col_nums, f_nums = row[:7]
+		if kind in "cfpu":
+			check(table_oid in relation_rows and has_columns(table_oid, col_nums))
 			if kind == "f":
-				f_table = relations[f_oid]
-				f_cols = [f_table.columns[n] for n in f_nums]
-				cons = data.ForeignKey(name, definition, cols, f_table, f_cols)
+				check(f_oid in relation_oids and has_columns(f_oid, f_nums))
+
+	for row in rows["functions"]:
+		oid, name, ns_oid, owner_oid, lang_oid, rettype_oid, argtype_oids = row[:7]
+		check(ns_oid in catalog.namespaces and owner_oid in catalog.roles)
+		check(lang_oid in catalog.languages and rettype_oid in type_oids)
+		check(set(int(oid) for oid in argtype_oids.split()).issubset(type_oids))
+
+	for row in rows["triggers"]:
+		table_oid, name, function_oid = row[:3]
+		check(table_oid in relation_rows and function_oid in function_oids)
+
+	for row in rows["rules"]:
+		name, table_oid = row[:2]
+		check(table_oid in relation_rows)
+
+	for row in rows["sequences"]:
+		oid, name, owner_oid, ns_oid = row
+		check(ns_oid in catalog.namespaces and owner_oid in catalog.roles)
+
+# Detaches the relation's parts from the objects they refer to
+
+def unlink_relation(relation):
+	for column in relation.columns.itervalues():
+		data.unxref(column, column.type)
+
+	if isinstance(relation, data.Index):
+		data.unxref(relation, relation.table)
+
+	if isinstance(relation, data.Table):
+		for cons in relation.constraints:
+			if isinstance(cons, data.ForeignKey):
+				data.unxref(cons, cons.foreign_table)
+				data.unxref(cons, cons.foreign_columns)
 			else:
-				cons = table_constraint_types[kind](name, definition, cols)
-			table.constraints.append(cons)
+				data.unxref(cons, cons.columns)
+
+		for trigger in relation.triggers:
+			data.unxref(trigger, trigger.function)
+
+# Equal objects share an entry in an xrefs set, so unlinking one of them may
+# have removed the entry of another
+
+def restore_xrefs(catalog):
+	for function in catalog.functions.itervalues():
+		data.xref(function, function.language)
+		data.xref(function, function.rettype)
+		data.xref(function, function.argtypes)
+
+	for relation in catalog.relations.itervalues():
+		for column in relation.columns.itervalues():
+			data.xref(column, column.type)
+
+		if isinstance(relation, data.Index):
+			data.xref(relation, relation.table)
+
+		if isinstance(relation, data.Table):
+			for cons in relation.constraints:
+				if isinstance(cons, data.ForeignKey):
+					data.xref(cons, cons.foreign_table)
+					data.xref(cons, cons.foreign_columns)
+				else:
+					data.xref(cons, cons.columns)
+
+			for trigger in relation.triggers:
+				data.xref(trigger, trigger.function)
+
+def remove_object(objects, obj):
+	objects[:] = [o for o in objects if o is not obj]
+
+# With a timeout a probe which waits for a table lock longer than that gives
+# up, instead of queuing the application's queries behind it; the content of
+# the table is left unknown.  lock_timeout is available since 9.3.  The
+# timeouts are reset to the connection's defaults afterwards.
+
+def probe_tables(cursor, db_prefix, tables, content, timeout=None):
+	if content == "stats":
+		for i in xrange(0, len(tables), probe_batch_size):
+			probe_table_stats(cursor, tables[i:i + probe_batch_size])
+		return
+
+	if timeout is not None:
+		set_probe_timeout(cursor, int(timeout * 1000))
+
+	try:
+		if content == "batch":
+			for i in xrange(0, len(tables), probe_batch_size):
+				probe_table_batch(cursor, db_prefix, tables[i:i + probe_batch_size])
 		else:
-			cons = domain_constraint_types[kind](name, definition)
-			types[domain_oid].constraints.append(cons)
+			probe_each_table(cursor, db_prefix, tables)
+	finally:
+		if timeout is not None:
+			reset_probe_timeout(cursor)
 
-	# Functions
+def set_probe_timeout(cursor, milliseconds):
+	if cursor.connection.server_version >= 90300:
+		cursor.execute("""SET lock_timeout = %d""" % milliseconds)
+	cursor.execute("""SET statement_timeout = %d""" % milliseconds)
 
-	cursor.execute("""SELECT oid, proname, pronamespace, proowner, prolang, prorettype,
-	                         proargtypes, prosrc, probin
-	                  FROM pg_proc
-	                  ORDER BY pronamespace, proname""")
-	for row in cursor:
-		oid, name, ns_oid, owner_oid, lang_oid, rettype_oid, argtype_oids, src1, src2 = row
-		ns = namespaces[ns_oid]
-		owner = roles[owner_oid]
-		lang = languages[lang_oid]
-		rettype = types[rettype_oid]
-		argtypes = [types[int(oid)] for oid in argtype_oids.split()]
-		src1 = trim_function(lang, src1)
-		function = data.Function(ns, name, owner, lang, rettype, argtypes, src1, src2)
-		functions[oid] = function
-		ns.functions.append(function)
+# A failed transaction can't run the resets, but rolling it back undoes the
+# settings anyway
 
-	# Triggers
+def reset_probe_timeout(cursor):
+	conn = cursor.connection
+	if conn.closed or \
+	   conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+		return
 
-	cursor.execute("""SELECT tgrelid, tgname, tgfoid, pg_get_triggerdef(oid)
-	                  FROM pg_trigger
-	                  WHERE NOT tgisconstraint
-	                  ORDER BY tgrelid, tgname""")
-	for row in cursor:
-		table_oid, name, function_oid, description = row
-		table = relations[table_oid]
-		trigger = data.Trigger(name, functions[function_oid], description, table)
-		table.triggers.append(trigger)
+	if conn.server_version >= 90300:
+		cursor.execute("""RESET lock_timeout""")
+	cursor.execute("""RESET statement_timeout""")
 
-	# Rules
+# Reads the statistics of the tables without locking them.  A table which
+# has never been analyzed has no tuple estimate.  The statistics lag behind
+# the contents, and neither relpages nor the visibility map tell an empty
+# table from one whose rows haven't been counted yet, so the tables without
+# rows are left unknown instead of empty.
 
-	cursor.execute("""SELECT rulename, ev_class, pg_get_ruledef(oid)
-	                  FROM pg_rewrite
-                          WHERE rulename != '_RETURN'
-	                  ORDER BY ev_class, rulename""")
-	for row in cursor:
-		name, table_oid, definition = row
-		rule = data.Rule(name, definition)
-		relations[table_oid].rules.append(rule)
+def probe_table_stats(cursor, tables):
+	checks = ["""(SELECT c.reltuples > 0 OR coalesce(s.n_live_tup, 0) > 0
+	              FROM pg_class AS c
+	              LEFT OUTER JOIN pg_stat_all_tables AS s ON s.relid = c.oid
+	              WHERE c.oid = %s::regclass)"""] * len(tables)
+	cursor.execute("""SELECT %s""" % ", ".join(checks), [n for n, t in tables])
 
-	# Operators
-	# TODO: operator properties
-	# TODO: operator class operators/functions
+	for (full_name, table), has_content in zip(tables, cursor.fetchone()):
+		table.init_content(has_content or data.unknown)
 
-	cursor.execute("""SELECT oid, oprname, oprnamespace, oprowner
-	                  FROM pg_operator
-	                  ORDER BY oprnamespace, oprname""")
-	for row in cursor:
-		oid, name, ns_oid, owner_oid = row
-		ns = namespaces[ns_oid]
-		operator = data.Operator(ns, name, roles[owner_oid])
-		operators[oid] = operator
-		ns.operators.append(operator)
-
-	cursor.execute("""SELECT pg_opclass.oid, amname, opcname, opcnamespace, opcowner,
-	                         opcintype, opcdefault, opckeytype
-	                  FROM pg_opclass, pg_am
-                          WHERE opcmethod = pg_am.oid
-	                  ORDER BY opcnamespace, opcname, opcintype, amname""")
-	for row in cursor:
-		oid, method, name, ns_oid, owner_oid, intype_oid, default, keytype_oid = row
-		ns = namespaces[ns_oid]
-		owner = roles[owner_oid]
-		intype = types[intype_oid]
-		keytype = types.get(keytype_oid)
-		opclass = data.OperatorClass(ns, method, name, owner, intype, default, keytype)
-		opclasses[oid] = opclass
-		ns.opclasses.append(opclass)
+def probe_table_batch(cursor, db_prefix, tables):
+	# Permissions are checked for the whole statement, so filter out the
+	# tables that would make it fail for everyone
+	checks = ["has_table_privilege(%s, 'SELECT')"] * len(tables)
+	cursor.execute("""SELECT %s""" % ", ".join(checks), [n for n, t in tables])
+	privileges = cursor.fetchone()
 
-	# TODO: casts
+	accessible = []
+	for (full_name, table), privilege in zip(tables, privileges):
+		if privilege:
+			accessible.append((full_name, table))
+		else:
+			print db_prefix, "Failed to access table", full_name
+
+	if not accessible:
+		return
+
+	probes = ["EXISTS (SELECT 1 FROM %s)" % n for n, t in accessible]
+	cursor.execute("""SAVEPOINT table_savepoint""")
+	try:
+		cursor.execute("""SELECT %s""" % ", ".join(probes))
+	except:
+		cursor.execute("""ROLLBACK TO SAVEPOINT table_savepoint""")
+		probe_each_table(cursor, db_prefix, accessible)
+	else:
+		for (full_name, table), has_content in zip(accessible, cursor.fetchone()):
+			table.init_content(has_content)
+		cursor.execute("""RELEASE SAVEPOINT table_savepoint""")
+
+def probe_sequences(cursor, db_prefix, sequences):
+	for full_name, sequence in sequences:
+		cursor.execute("""SAVEPOINT sequence""")
+		try:
+			cursor.execute("""SELECT increment_by, min_value, max_value
+			                  FROM %s""" % full_name)
+		except:
+			cursor.execute("""ROLLBACK TO SAVEPOINT sequence""")
+			print db_prefix, "Failed to access sequence", full_name
+		else:
+			sequence.init_values(*cursor.fetchone())
+			cursor.execute("""RELEASE SAVEPOINT sequence""")
+
+# lock_not_available and query_canceled
+timeout_errors = ["55P03", "57014"]
+
+def probe_each_table(cursor, db_prefix, tables):
+	for full_name, table in tables:
+		cursor.execute("""SAVEPOINT table_savepoint""")
+		try:
+			cursor.execute("""SELECT 1 FROM %s LIMIT 1""" % full_name)
+		except psycopg2.Error, e:
+			cursor.execute("""ROLLBACK TO SAVEPOINT table_savepoint""")
+			if e.pgcode in timeout_errors:
+				print db_prefix, "Timed out probing table", full_name
+			else:
+				print db_prefix, "Failed to access table", full_name
+		else:
+			table.init_content(cursor.fetchone() is not None)
+			cursor.execute("""RELEASE SAVEPOINT table_savepoint""")
 
-def trim_function(language, source):
-	if language.name == "plpgsql":
-		buf = ""
-		for line in source.split("\n"):
-			line = line.strip()
-			if line:
-				if buf:
-					buf += " "
-				buf += line
-		source = buf
-	return source
+def quote_name(ns_name, name):
+	return '"%s"."%s"' % (ns_name, name)
@@ -0,0 +1,80 @@
+import contextlib
+import time
+
+# Loading statistics of a database.  Each phase of the loader records:
+#   time       -- wall time of the phase
+#   query_time -- time spent waiting for the server; when loading over
+#                 several connections the queries run ahead, so this may
+#                 overlap other phases
+#   rows       -- catalog rows fetched
+#   objects    -- objects built
+
+class Phase(object):
+	def __init__(self, name):
+		self.name = name
+		self.time = 0.0
+		self.query_time = 0.0
+		self.rows = 0
+		self.objects = 0
+
+class Stats(object):
+	def __init__(self, name, callback=None):
+		self.name = name
+		self.callback = callback
+		self.phases = []
+		self.__map = {}
+
+	# The callback isn't stored with cached databases
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state["callback"] = None
+		return state
+
+	def get(self, name):
+		phase = self.__map.get(name)
+		if phase is None:
+			phase = Phase(name)
+			self.phases.append(phase)
+			self.__map[name] = phase
+		return phase
+
+	@contextlib.contextmanager
+	def measure(self, name):
+		phase = self.get(name)
+		start = time.time()
+		try:
+			yield phase
+		finally:
+			phase.time += time.time() - start
+			if self.callback:
+				self.callback(self.name, phase)
+
+	def get_total(self):
+		total = Phase("total")
+		for phase in self.phases:
+			total.time += phase.time
+			total.query_time += phase.query_time
+			total.rows += phase.rows
+			total.objects += phase.objects
+		return total
+
+	def format(self):
+		lines = ["%s:" % self.name,
+		         "  %-16s %9s %9s %9s %9s" % ("phase", "time", "query", "rows", "objects")]
+		for phase in self.phases + [self.get_total()]:
+			lines.append("  %-16s %9.3f %9.3f %9d %9d" % (phase.name, phase.time, phase.query_time,
+			                                             phase.rows, phase.objects))
+		return "\n".join(lines)
+
+# Measures the time spent in a call which waits for the server
+
+def timed(phase, call, *args):
+	if phase is None:
+		return call(*args)
+
+	start = time.time()
+	try:
+		return call(*args)
+	finally:
+		phase.query_time += time.time() - start
@@ -363,6 +363,8 @@ def generate(diff):
 	global database_objects
 	database_objects = diff.objects
 
+	core.data.fetch_deferred(core.diff.get_values(diff))
+
 	tree = tags.TagTree()
 	gen_database(tree, diff)
 	return tree.get_element_tree()
@@ -6,6 +6,8 @@ import pgcs.core.diff
 import pgcs.core.load
 core = pgcs.core
 
+import pgcs.tool.options
+
 import pgcs.html.diff
 html = pgcs.html
 
@@ -184,10 +186,11 @@ def get_diffs(diff):
 			yield diff
 
 def main():
-	source, target = sys.argv[1:]
+	options, (source, target) = pgcs.tool.options.parse_args("%prog [options] SOURCE TARGET", 2, 2)
 
-	databases = core.load.load_databases([source, target])
-	diff_tree = core.diff.diff_databases(databases)
+	load_options = pgcs.tool.options.get_load_options(options)
+	databases = core.load.load_databases([source, target], **load_options)
+	diff_tree = core.diff.diff_databases(databases, options.diff_processes)
 
 	for diff in get_diffs(diff_tree):
 		kind = type(diff)
@@ -5,10 +5,11 @@ import pgcs.core.diff
 import pgcs.core.load
 import pgcs.html.diff
 import pgcs.html.tags
+import pgcs.tool.options
 
-def main(file, sources):
-	databases = pgcs.core.load.load_databases(sources)
-	diff = pgcs.core.diff.diff_databases(databases)
+def main(file, sources, diff_processes=None, **load_options):
+	databases = pgcs.core.load.load_databases(sources, **load_options)
+	diff = pgcs.core.diff.diff_databases(databases, diff_processes)
 	diff_tree = pgcs.html.diff.generate(diff)
 
 	doc = pgcs.html.tags.TagTree()
@@ -23,4 +24,5 @@ def main(file, sources):
 	doc_tree.write(file, "utf-8")
 
 if __name__ == "__main__":
-	main(sys.argv[1], sys.argv[2:])
+	options, args = pgcs.tool.options.parse_args("%prog [options] FILE SOURCE...", 2)
+	main(args[0], args[1:], options.diff_processes, **pgcs.tool.options.get_load_options(options))
@@ -5,6 +5,8 @@ import pgcs.core.diff
 import pgcs.core.load
 core = pgcs.core
 
+import pgcs.tool.options
+
 def get_entries(named_object_list):
 	if named_object_list:
 		return named_object_list.entries
@@ -46,10 +48,11 @@ commands = {
 }
 
 def main():
-	source, target = sys.argv[1:]
+	options, (source, target) = pgcs.tool.options.parse_args("%prog [options] SOURCE TARGET", 2, 2)
 
-	databases = core.load.load_databases([source, target])
-	diff_tree = core.diff.diff_databases(databases)
+	load_options = pgcs.tool.options.get_load_options(options)
+	databases = core.load.load_databases([source, target], **load_options)
+	diff_tree = core.diff.diff_databases(databases, options.diff_processes)
 
 	for diff in get_diffs(diff_tree):
 		obj1, obj2 = diff.objects
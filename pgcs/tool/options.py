@@ -0,0 +1,82 @@
+import optparse
+import sys
+
+import pgcs.core.load
+core = pgcs.core
+
+def parse_args(usage, minargs, maxargs=None):
+	parser = optparse.OptionParser(usage=usage)
+	parser.add_option("--cache", metavar="DIR", dest="cache_dir",
+	                  help="reuse schema snapshots stored in DIR while the catalog is unchanged")
+	parser.add_option("--incremental", action="store_true", default=False,
+	                  help="patch cached snapshots with the catalog rows which have changed")
+	parser.add_option("--content", metavar="MODE", type="choice",
+	                  choices=core.load.content_modes, default="probe",
+	                  help="how to find out which tables have rows: %s [default: %%default]"
+	                       % ", ".join(core.load.content_modes))
+	parser.add_option("--probe-timeout", metavar="SECONDS", type="float",
+	                  help="leave the content of a table unknown if probing it waits for a lock "
+	                       "longer than SECONDS")
+	parser.add_option("--interesting-only", action="store_true", default=False,
+	                  help="load system and ignored schemas only as far as other objects refer to them")
+	parser.add_option("--digests", action="store_true", default=False,
+	                  help="load digests of definition texts, and fetch only the texts which differ")
+	parser.add_option("--skip-identical", action="store_true", default=False,
+	                  help="skip loading the schemas which are identical in all databases (PostgreSQL 10+)")
+	parser.add_option("--connections", metavar="N", type="int", default=1,
+	                  help="load each database over N connections sharing one snapshot [default: %default]")
+	parser.add_option("--batch-size", metavar="N", type="int",
+	                  help="stream catalog query results through server-side cursors N rows at a time")
+	parser.add_option("--workers", metavar="N", type="int",
+	                  help="load at most N databases at a time")
+	parser.add_option("--host-limit", metavar="N", type="int",
+	                  help="open at most N connections to a server at a time")
+	parser.add_option("--timeout", metavar="SECONDS", type="float",
+	                  help="cancel the loading of a database after SECONDS")
+	parser.add_option("--fail-fast", action="store_true", default=False,
+	                  help="stop loading the other databases when one fails")
+	parser.add_option("--diff-processes", metavar="N", type="int",
+	                  help="compare the schemas in N worker processes")
+	parser.add_option("--stats", action="store_true", default=False,
+	                  help="print the time, rows and objects of each loading phase to stderr")
+
+	# Only the tools which compare any number of databases can do without
+	# some of them
+	if maxargs is None:
+		parser.add_option("--skip-failed", action="store_true", default=False,
+		                  help="leave out the databases which fail to load")
+
+	options, args = parser.parse_args()
+
+	if len(args) < minargs or (maxargs is not None and len(args) > maxargs):
+		parser.error("wrong number of arguments")
+
+	# The rows of each query are collected in full when several connections
+	# load a database, so a batch size wouldn't limit anything
+	if options.batch_size and options.connections > 1:
+		parser.error("--batch-size can't be used with more than one connection")
+
+	return options, args
+
+def get_load_options(options):
+	return dict(cache_dir=options.cache_dir,
+	            incremental=options.incremental,
+	            content=options.content,
+	            probe_timeout=options.probe_timeout,
+	            interesting_only=options.interesting_only,
+	            digests=options.digests,
+	            skip_identical=options.skip_identical,
+	            connections=options.connections,
+	            batch_size=options.batch_size,
+	            workers=options.workers,
+	            host_limit=options.host_limit,
+	            timeout=options.timeout,
+	            fail_fast=options.fail_fast,
+	            skip_failed=getattr(options, "skip_failed", False),
+	            stats_callback=options.stats and print_phase or None)
+
+# Called by the loading threads, so each phase is written at once
+
+def print_phase(name, phase):
+	sys.stderr.write("%s: %-12s %8.3fs  query %8.3fs  %8d rows  %8d objects\n" % (
+		name, phase.name, phase.time, phase.query_time, phase.rows, phase.objects))
@@ -0,0 +1,83 @@
+--
+-- PostgreSQL database dump
+--
+
+-- Dumped from database version 13.4
+-- Dumped by pg_dump version 13.4
+
+SET statement_timeout = 0;
+SET lock_timeout = 0;
+SET idle_in_transaction_session_timeout = 0;
+SET client_encoding = 'UTF8';
+SET standard_conforming_strings = on;
+SELECT pg_catalog.set_config('search_path', '', false);
+SET check_function_bodies = false;
+SET xmloption = content;
+SET client_min_messages = warning;
+SET row_security = off;
+
+--
+-- Name: add_one(integer); Type: FUNCTION; Schema: public; Owner: admin
+--
+
+CREATE FUNCTION public.add_one(integer) RETURNS integer
+    LANGUAGE c STRICT
+    AS '$libdir/add_one', 'add_one';
+
+
+ALTER FUNCTION public.add_one(integer) OWNER TO admin;
+
+SET default_tablespace = '';
+
+SET default_table_access_method = heap;
+
+--
+-- Name: items; Type: TABLE; Schema: public; Owner: admin
+--
+
+CREATE TABLE public.items (
+    id integer NOT NULL,
+    name text NOT NULL
+);
+
+
+ALTER TABLE public.items OWNER TO admin;
+
+--
+-- Name: items_id_seq; Type: SEQUENCE; Schema: public; Owner: admin
+--
+
+ALTER TABLE public.items ALTER COLUMN id ADD GENERATED ALWAYS AS IDENTITY (
+    SEQUENCE NAME public.items_id_seq
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1
+);
+
+
+--
+-- Name: tools; Type: TABLE; Schema: public; Owner: admin
+--
+
+CREATE TABLE public.tools (
+    weight integer
+)
+INHERITS (public.items);
+
+
+ALTER TABLE public.tools OWNER TO admin;
+
+--
+-- Name: items items_pkey; Type: CONSTRAINT; Schema: public; Owner: admin
+--
+
+ALTER TABLE ONLY public.items
+    ADD CONSTRAINT items_pkey PRIMARY KEY (id);
+
+
+--
+-- PostgreSQL database dump complete
+--
+
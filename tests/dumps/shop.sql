@@ -0,0 +1,167 @@
+--
+-- PostgreSQL database dump
+--
+
+-- Dumped from database version 13.4
+-- Dumped by pg_dump version 13.4
+
+SET statement_timeout = 0;
+SET lock_timeout = 0;
+SET idle_in_transaction_session_timeout = 0;
+SET client_encoding = 'UTF8';
+SET standard_conforming_strings = on;
+SELECT pg_catalog.set_config('search_path', '', false);
+SET check_function_bodies = false;
+SET xmloption = content;
+SET client_min_messages = warning;
+SET row_security = off;
+
+--
+-- Name: shop; Type: SCHEMA; Schema: -; Owner: admin
+--
+
+CREATE SCHEMA shop;
+
+
+ALTER SCHEMA shop OWNER TO admin;
+
+--
+-- Name: touch(); Type: FUNCTION; Schema: shop; Owner: admin
+--
+
+CREATE FUNCTION shop.touch() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+begin
+    new.modified := now();
+
+    return new;
+end;
+$$;
+
+
+ALTER FUNCTION shop.touch() OWNER TO admin;
+
+SET default_tablespace = '';
+
+SET default_table_access_method = heap;
+
+--
+-- Name: customers; Type: TABLE; Schema: shop; Owner: admin
+--
+
+CREATE TABLE shop.customers (
+    id integer NOT NULL,
+    name text NOT NULL,
+    email character varying(200),
+    modified timestamp with time zone DEFAULT now()
+);
+
+
+ALTER TABLE shop.customers OWNER TO admin;
+
+--
+-- Name: customers_id_seq; Type: SEQUENCE; Schema: shop; Owner: admin
+--
+
+CREATE SEQUENCE shop.customers_id_seq
+    AS integer
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1;
+
+
+ALTER TABLE shop.customers_id_seq OWNER TO admin;
+
+--
+-- Name: customers_id_seq; Type: SEQUENCE OWNED BY; Schema: shop; Owner: admin
+--
+
+ALTER SEQUENCE shop.customers_id_seq OWNED BY shop.customers.id;
+
+
+--
+-- Name: orders; Type: TABLE; Schema: shop; Owner: admin
+--
+
+CREATE TABLE shop.orders (
+    id bigint NOT NULL,
+    customer_id integer NOT NULL,
+    total numeric(10,2) DEFAULT 0 NOT NULL,
+    CONSTRAINT orders_total_check CHECK ((total >= (0)::numeric))
+);
+
+
+ALTER TABLE shop.orders OWNER TO admin;
+
+--
+-- Name: big_orders; Type: VIEW; Schema: shop; Owner: admin
+--
+
+CREATE VIEW shop.big_orders AS
+ SELECT orders.id,
+    orders.total
+   FROM shop.orders
+  WHERE (orders.total > (100)::numeric);
+
+
+ALTER TABLE shop.big_orders OWNER TO admin;
+
+--
+-- Name: customers id; Type: DEFAULT; Schema: shop; Owner: admin
+--
+
+ALTER TABLE ONLY shop.customers ALTER COLUMN id SET DEFAULT nextval('shop.customers_id_seq'::regclass);
+
+
+--
+-- Name: customers customers_pkey; Type: CONSTRAINT; Schema: shop; Owner: admin
+--
+
+ALTER TABLE ONLY shop.customers
+    ADD CONSTRAINT customers_pkey PRIMARY KEY (id);
+
+
+--
+-- Name: orders orders_pkey; Type: CONSTRAINT; Schema: shop; Owner: admin
+--
+
+ALTER TABLE ONLY shop.orders
+    ADD CONSTRAINT orders_pkey PRIMARY KEY (id);
+
+
+--
+-- Name: customers_email_key; Type: INDEX; Schema: shop; Owner: admin
+--
+
+CREATE UNIQUE INDEX customers_email_key ON shop.customers USING btree (email);
+
+
+--
+-- Name: orders_customer_id_idx; Type: INDEX; Schema: shop; Owner: admin
+--
+
+CREATE INDEX orders_customer_id_idx ON shop.orders USING btree (customer_id);
+
+
+--
+-- Name: customers customers_touch; Type: TRIGGER; Schema: shop; Owner: admin
+--
+
+CREATE TRIGGER customers_touch BEFORE UPDATE ON shop.customers FOR EACH ROW EXECUTE FUNCTION shop.touch();
+
+
+--
+-- Name: orders orders_customer_id_fkey; Type: FK CONSTRAINT; Schema: shop; Owner: admin
+--
+
+ALTER TABLE ONLY shop.orders
+    ADD CONSTRAINT orders_customer_id_fkey FOREIGN KEY (customer_id) REFERENCES shop.customers(id);
+
+
+--
+-- PostgreSQL database dump complete
+--
+
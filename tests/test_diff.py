@@ -0,0 +1,230 @@
+import StringIO
+import os
+import sys
+import threading
+import time
+import unittest
+import xml.etree.ElementTree as et
+
+import pgcs.core.diff
+import pgcs.core.dump
+import pgcs.core.future
+import pgcs.html.diff
+core = pgcs.core
+html = pgcs.html
+
+# shop_v2.sql adds a column, changes a check and adds two operators which
+# share a name.  Only the last operator of a name is compared, so
+# shop_v2_reordered.sql, which lists them the other way round, differs from
+# it.  shop_v2_hidden.sql has a third operator of the name in the middle.
+
+dumps_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dumps")
+
+sources = [
+	"shop.sql",
+	"shop_v2.sql",
+	"features.sql",
+	"shop_v2_reordered.sql",
+	"shop.sql",
+	"shop_v2.sql",
+	"shop_v2_hidden.sql",
+]
+
+def load(name):
+	return core.dump.load_dump(os.path.join(dumps_dir, name), set())
+
+def unclustered(objects):
+	return objects, None
+
+def diff(databases, clustered=True, processes=None):
+	cluster = core.diff.cluster
+	if not clustered:
+		core.diff.cluster = unclustered
+	try:
+		d = core.diff.diff_databases(databases, processes)
+		core.diff.complete(d)
+	finally:
+		core.diff.cluster = cluster
+	return d
+
+def render(d):
+	return et.tostring(html.diff.generate(d).getroot())
+
+def get_namespace(db, name):
+	for ns in db.namespaces:
+		if ns.name == name:
+			return ns
+	raise KeyError(name)
+
+def get_entry(named_object_list, name):
+	for entry in named_object_list.entries:
+		if entry.name == name:
+			return entry
+	raise KeyError(name)
+
+class ClusterTest(unittest.TestCase):
+	def setUp(self):
+		self.databases = [load(name) for name in sources]
+
+	def test_classes(self):
+		representatives, classes = core.diff.cluster(self.databases)
+		self.assertEqual(classes, [0, 1, 2, 3, 0, 1, 4])
+		self.assertEqual(representatives, [self.databases[i] for i in (0, 1, 2, 3, 6)])
+
+	def test_no_classes(self):
+		databases = self.databases[:3]
+		self.assertEqual(core.diff.cluster(databases), (databases, None))
+
+	def test_same_output(self):
+		self.assertEqual(render(diff(self.databases)),
+		                 render(diff(self.databases, clustered=False)))
+
+	def test_same_output_in_processes(self):
+		if not hasattr(os, "fork"):
+			return
+		expected = render(diff(self.databases, clustered=False))
+		self.assertEqual(render(diff(self.databases, processes=2)), expected)
+		self.assertEqual(render(diff(self.databases, clustered=False, processes=2)), expected)
+
+	# Each database's entry has the operator which its own diff would show
+	def test_shared_names(self):
+		entries = []
+		for clustered in (True, False):
+			namespace = get_entry(diff(self.databases, clustered).namespaces, "shop")
+			entries.append(get_entry(namespace.diff.operators, "==="))
+
+		expanded, expected = entries
+		for obj, other in zip(expanded.objects, expected.objects):
+			self.assertTrue(obj is other)
+		self.assertEqual(expanded.value.values, expected.value.values)
+		self.assertEqual([obj and obj.owner for obj in expanded.objects],
+		                 [None, "shop_owner", None, "admin", None, "shop_owner", "shop_owner"])
+
+class ValueTest(unittest.TestCase):
+	def test_groups(self):
+		value = core.diff.Value([1, None, 1, 2])
+		self.assertEqual(value.values, [(1, 0), (None, -1), (1, 0), (2, 1)])
+		self.assertEqual(value.groups, 2)
+		self.assertTrue(value)
+
+	def test_equal(self):
+		value = core.diff.Value(["a", "a", None])
+		self.assertEqual(value.groups, 1)
+		self.assertFalse(value)
+
+	def test_lists(self):
+		value = core.diff.Value([[1, 2], [1, 2], [2, 1]])
+		self.assertEqual([group for obj, group in value.values], [0, 0, 1])
+
+	def test_unhashable(self):
+		value = core.diff.Value([{"a": 1}, {"a": 2}, {"a": 1}])
+		self.assertEqual([group for obj, group in value.values], [0, 1, 0])
+		self.assertEqual(value.groups, 2)
+
+	def test_expand(self):
+		value = core.diff.Value(["a", "b"]).expand([0, 1, 0], ["a", "b", "a"])
+		self.assertEqual(value.values, [("a", 0), ("b", 1), ("a", 0)])
+		self.assertEqual(value.groups, 2)
+
+class LazyDiffTest(unittest.TestCase):
+	def setUp(self):
+		self.databases = [load("shop.sql"), load("shop_v2.sql")]
+
+	def test_computed_when_read(self):
+		d = core.diff.diff_databases(self.databases)
+		self.assertFalse("namespaces" in d.__dict__)
+		self.assertTrue(d.namespaces)
+		self.assertTrue("namespaces" in d.__dict__)
+		self.assertFalse("languages" in d.__dict__)
+
+	def test_equal(self):
+		d = core.diff.diff_databases([self.databases[0], load("shop.sql")])
+		self.assertEqual(d.languages, None)
+		self.assertEqual(d.namespaces, None)
+		self.assertFalse(d)
+
+	def test_unknown_attribute(self):
+		d = core.diff.diff_databases(self.databases)
+		self.assertRaises(AttributeError, getattr, d, "tables")
+
+	def test_expanded_from_base(self):
+		databases = self.databases + [load("shop.sql")]
+		d = core.diff.diff_databases(databases)
+		self.assertFalse(d.base is None)
+		self.assertEqual(d.classes, [0, 1, 0])
+		self.assertFalse("namespaces" in d.base.__dict__)
+
+		entry = get_entry(d.namespaces, "shop")
+		self.assertTrue("namespaces" in d.base.__dict__)
+		self.assertEqual(entry.objects, [get_namespace(db, "shop") for db in databases])
+
+class PoolTest(unittest.TestCase):
+	def setUp(self):
+		self.lock = threading.Lock()
+		self.running = {}
+		self.peaks = {}
+		self.release = threading.Event()
+
+	def task(self, key, duration=0.05):
+		with self.lock:
+			self.running[key] = self.running.get(key, 0) + 1
+			self.peaks[key] = max(self.peaks.get(key, 0), sum(self.running.values()))
+		time.sleep(duration)
+		with self.lock:
+			self.running[key] -= 1
+		return key
+
+	def run_tasks(self, pool, tasks):
+		futures = [pool.submit(key, weight, self.task, key) for key, weight in tasks]
+		core.future.wait(futures)
+		return [f.get() for f in futures]
+
+	def test_workers(self):
+		pool = core.future.Pool(workers=2)
+		self.assertEqual(self.run_tasks(pool, [("a", 1)] * 5), ["a"] * 5)
+		self.assertEqual(self.peaks["a"], 2)
+
+	def test_key_limit(self):
+		pool = core.future.Pool(key_limit=1)
+		self.run_tasks(pool, [("a", 1), ("a", 1), ("b", 1), ("b", 1)])
+		self.assertEqual(max(self.peaks.values()), 2)
+
+	def test_heavy_task_runs_alone(self):
+		pool = core.future.Pool(workers=2)
+		self.run_tasks(pool, [("a", 1), ("b", 3), ("c", 1)])
+		self.assertEqual(self.peaks["b"], 1)
+
+	def wait_for_release(self):
+		self.release.wait()
+
+	def raise_error(self):
+		raise ValueError("failed")
+
+	def test_fail_fast(self):
+		pool = core.future.Pool()
+		futures = [pool.submit("a", 1, self.wait_for_release) for i in xrange(3)]
+		futures.insert(1, pool.submit("a", 1, self.raise_error))
+
+		stderr = sys.stderr
+		sys.stderr = StringIO.StringIO()
+		try:
+			failed = core.future.wait(futures, fail_fast=True)
+		finally:
+			sys.stderr = stderr
+			self.release.set()
+
+		self.assertTrue(failed is futures[1])
+		self.assertTrue(isinstance(failed._error, ValueError))
+		self.assertEqual([f.cancelled() for f in futures], [True, False, True, True])
+
+	def test_timeout(self):
+		pool = core.future.Pool(timeout=0.05)
+		result = pool.submit("a", 1, self.wait_for_release)
+		try:
+			self.assertRaises(core.future.FutureError, result.get)
+			self.assertTrue(result.cancelled())
+		finally:
+			self.release.set()
+
+if __name__ == "__main__":
+	unittest.main()
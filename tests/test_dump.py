@@ -0,0 +1,150 @@
+import os
+import unittest
+
+import pgcs.core.data
+import pgcs.core.dump
+core = pgcs.core
+
+# The fixtures are pg_dump --schema-only outputs of PostgreSQL 13.
+# shop.sql.gz is shop.sql compressed.
+
+dumps_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dumps")
+
+def load(name):
+	return core.dump.load_dump(os.path.join(dumps_dir, name), set())
+
+def get_namespace(db, name):
+	for ns in db.namespaces:
+		if ns.name == name:
+			return ns
+	raise KeyError(name)
+
+def get_names(objects):
+	return sorted([obj.get_name() for obj in objects])
+
+def get_object(objects, name):
+	for obj in objects:
+		if obj.get_name() == name:
+			return obj
+	raise KeyError(name)
+
+def get_columns(relation):
+	return [(column.name, column.type.name, column.notnull, column.default)
+	        for num, column in sorted(relation.columns.iteritems())]
+
+# Every object of a database with its key and value digest
+def describe(db):
+	return sorted([(type(obj).__name__, obj.flatten(), obj.value_digest())
+	               for obj in core.data.walk(db) if not isinstance(obj, core.data.Database)])
+
+class PlainDumpTest(unittest.TestCase):
+	def setUp(self):
+		self.db = load("shop.sql")
+		self.ns = get_namespace(self.db, "shop")
+
+	def test_database(self):
+		self.assertEqual(self.db.get_name(), "shop")
+		self.assertEqual(get_names(self.db.namespaces), ["public", "shop"])
+		self.assertEqual(get_names(self.db.languages), ["plpgsql"])
+		self.assertEqual(self.ns.owner, "admin")
+
+	def test_objects(self):
+		self.assertEqual(get_names(self.ns.tables), ["customers", "orders"])
+		self.assertEqual(get_names(self.ns.views), ["big_orders"])
+		self.assertEqual(get_names(self.ns.sequences), ["customers_id_seq"])
+		self.assertEqual(get_names(self.ns.functions), ["touch()"])
+		self.assertEqual(get_names(self.ns.indexes),
+		                 ["customers_email_key", "customers_pkey", "orders_customer_id_idx",
+		                  "orders_pkey"])
+
+	def test_columns(self):
+		customers = get_object(self.ns.tables, "customers")
+		self.assertEqual(get_columns(customers), [
+			("id", "int4", True, "nextval('shop.customers_id_seq'::regclass)"),
+			("name", "text", True, None),
+			("email", "varchar", False, None),
+			("modified", "timestamptz", False, "now()"),
+		])
+
+		orders = get_object(self.ns.tables, "orders")
+		self.assertEqual(get_columns(orders), [
+			("id", "int8", True, None),
+			("customer_id", "int4", True, None),
+			("total", "numeric", True, "0"),
+		])
+
+	def test_constraints(self):
+		orders = get_object(self.ns.tables, "orders")
+		constraints = dict((c.name, c) for c in orders.constraints)
+		self.assertEqual(sorted(constraints),
+		                 ["orders_customer_id_fkey", "orders_pkey", "orders_total_check"])
+
+		self.assertTrue(isinstance(constraints["orders_pkey"], core.data.PrimaryKey))
+		self.assertEqual([c.name for c in constraints["orders_pkey"].columns], ["id"])
+
+		check = constraints["orders_total_check"]
+		self.assertTrue(isinstance(check, core.data.CheckColumnConstraint))
+		self.assertEqual(check.definition, "CHECK ((total >= (0)::numeric))")
+
+		foreign = constraints["orders_customer_id_fkey"]
+		self.assertTrue(isinstance(foreign, core.data.ForeignKey))
+		self.assertEqual([c.name for c in foreign.columns], ["customer_id"])
+		self.assertEqual(foreign.foreign_table.name, "customers")
+		self.assertEqual([c.name for c in foreign.foreign_columns], ["id"])
+
+	def test_indexes(self):
+		index = get_object(self.ns.indexes, "orders_customer_id_idx")
+		self.assertEqual(index.table.name, "orders")
+		self.assertEqual([c.name for n, c in sorted(index.columns.iteritems())], ["customer_id"])
+
+	def test_sequence(self):
+		sequence = get_object(self.ns.sequences, "customers_id_seq")
+		self.assertEqual(sequence.owner, "admin")
+		self.assertEqual((sequence.increment, sequence.minimum, sequence.maximum),
+		                 (1, 1, 2147483647))
+
+	def test_function_and_trigger(self):
+		function = get_object(self.ns.functions, "touch()")
+		self.assertEqual(function.language.name, "plpgsql")
+		self.assertEqual(function.rettype.name, "trigger")
+		self.assertEqual(function.source1, "begin new.modified := now(); return new; end;")
+
+		customers = get_object(self.ns.tables, "customers")
+		trigger, = customers.triggers
+		self.assertEqual(trigger.name, "customers_touch")
+		self.assertTrue(trigger.function is function)
+
+class GzipDumpTest(unittest.TestCase):
+	def test_same_as_plain(self):
+		db = load("shop.sql.gz")
+		self.assertEqual(db.get_name(), "shop")
+		self.assertEqual(describe(db), describe(load("shop.sql")))
+
+class FeaturesDumpTest(unittest.TestCase):
+	def setUp(self):
+		self.db = load("features.sql")
+		self.ns = get_namespace(self.db, "public")
+
+	def test_inheritance(self):
+		tools = get_object(self.ns.tables, "tools")
+		self.assertEqual(get_columns(tools), [
+			("id", "int4", True, None),
+			("name", "text", True, None),
+			("weight", "int4", False, None),
+		])
+		self.assertEqual(tools.constraints, ())
+
+	def test_identity_column(self):
+		sequence = get_object(self.ns.sequences, "items_id_seq")
+		self.assertEqual(sequence.owner, "admin")
+		self.assertEqual((sequence.increment, sequence.minimum, sequence.maximum),
+		                 (1, 1, 2147483647))
+
+	def test_c_function(self):
+		function = get_object(self.ns.functions, "add_one(int4)")
+		self.assertEqual(function.language.name, "c")
+		self.assertEqual(function.rettype.name, "int4")
+		self.assertEqual((function.source1, function.source2), ("add_one", "$libdir/add_one"))
+
+if __name__ == "__main__":
+	unittest.main()